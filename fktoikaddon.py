@@ -6,8 +6,64 @@ bl_info = {
     "version": (1, 1, 0),
 }
 import os
+import sys
+import json
+import math
+import re
+import bisect
+import fnmatch
+import hashlib
+import time
+import argparse
+import itertools
+import shutil
+import tempfile
+import subprocess
+import traceback
 import bpy
-from typing import Callable, Literal, ParamSpec, TypeVar, cast
+from bpy_extras.io_utils import ExportHelper, ImportHelper
+from mathutils import Matrix
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from typing import Any, Callable, Generator, Literal, ParamSpec, Sequence, TypeVar, cast
+
+# the bpy-free core is installed next to this file
+if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from fktoikcore import (
+    fk_to_ik as fk_to_ik_arrays,
+    INTERPOLATION,
+    channels_to_matrices,
+    create_transforms,
+    decimate_samples,
+    distance_error,
+    block_hashes,
+    chain_subset,
+    changed_ranges,
+    evaluate_keys,
+    forward_kinematics,
+    matrices_to_channels,
+    match_bones,
+    max_error,
+    merge_ranges,
+    pack_pose,
+    profile_count,
+    profile_sample,
+    profile_span,
+    Profile,
+    read_transforms,
+    retarget,
+    retarget_offsets,
+    rotation_channel,
+    rotation_error,
+    rotations_compatible,
+    sample_frames,
+    synthetic_hierarchy,
+    synthetic_take,
+    unpack_pose,
+    unparent,
+)
 
 _PS = ParamSpec("_PS")
 _TV = TypeVar("_TV")
@@ -41,35 +97,127 @@ class Logger:
 
 
 class Progress:
-    def __init__(self, *args, **kwargs): ...
-    def update(self, *args, **kwargs): ...
+    """Frame progress of the running bake, drives the window manager's progress bar.
+    The latest one is kept as `Progress.current` for the modal operators' status text.
+    """
+
+    current: "Progress | None" = None
+
+    def __init__(self, frame_start: float, frame_end: float, step=1.0):
+        self.total = max(len(sample_frames(frame_start, frame_end, step)), 1)
+        self.done = 0
+        self.time_start = time.perf_counter()
+        if not bpy.app.background:
+            bpy.context.window_manager.progress_begin(0, self.total)
+        Progress.current = self
+
+    def update(self, step=1):
+        self.done += step
+        profile_count("frames", step)
+        if not bpy.app.background:
+            bpy.context.window_manager.progress_update(self.done)
+
+    def end(self):
+        if not bpy.app.background:
+            bpy.context.window_manager.progress_end()
+        if Progress.current is self:
+            Progress.current = None
+
+    @property
+    def eta(self):
+        """Estimated seconds left"""
+        if not self.done:
+            return float("inf")
+        elapsed = time.perf_counter() - self.time_start
+        return elapsed / self.done * (self.total - self.done)
+
+    def __str__(self):
+        return f"{self.done}/{self.total} frames ({self.done / self.total:.0%}), ETA {self.eta:.0f}s"
 
 
 Log = Logger()
 GEN = []
 
 
-def duplicate_bones(armature_name, bone_names):
-    """Duplicate specified bones in the armature"""
-    bpy.ops.object.mode_set(mode="OBJECT")
-    armature = bpy.data.objects.get(armature_name)
-    if not (armature and isinstance(armature.data, bpy.types.Armature)):
-        Log.error("Armature not found.")
-        return
-
-    bpy.context.view_layer.objects.active = armature
-    armature.select_set(True)
-    bpy.ops.object.mode_set(mode="EDIT")
+class ArmatureSession:
+    """Resolve the armature once and keep it active for a whole conversion.
+    Mode switches only happen when a step really needs another mode, and the user's
+    active object, selection and mode are restored on exit."""
 
-    if "IK" not in armature.data.collections:
-        ik_collection = armature.data.collections.new("IK")
+    def __init__(self, armature_name: str):
+        armature = bpy.data.objects.get(armature_name)
+        if not (armature and isinstance(armature.data, bpy.types.Armature)):
+            raise ValueError(f"Armature '{armature_name}' not found.")
+        self.armature: bpy.types.Object = armature
+        self.data: bpy.types.Armature = armature.data
+        self.mode_switches = 0
+
+    def __enter__(self):
+        view_layer = bpy.context.view_layer
+        self._active = view_layer.objects.active
+        self._mode = self._active.mode if self._active else "OBJECT"
+        self._selected = list(bpy.context.selected_objects)
+        self._bone_select = {b.name: b.select for b in self.data.bones}
+        if self._active and self._active != self.armature and self._mode != "OBJECT":
+            bpy.ops.object.mode_set(mode="OBJECT")
+            self.mode_switches += 1
+        view_layer.objects.active = self.armature
+        self.armature.select_set(True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.armature.mode == "EDIT" or self._active != self.armature:
+            self.set_mode("OBJECT")
+        for bone in self.data.bones:
+            bone.select = self._bone_select.get(bone.name, False)
+        view_layer = bpy.context.view_layer
+        for obj in bpy.context.selected_objects:
+            obj.select_set(False)
+        for obj in self._selected:
+            obj.select_set(True)
+        view_layer.objects.active = self._active
+        if self._active and self._active.mode != self._mode:
+            bpy.ops.object.mode_set(mode=self._mode)
+            self.mode_switches += 1
+        Log.debug(f"mode switches: {self.mode_switches}")
+        profile_count("mode switches", self.mode_switches)
+        return False
+
+    def set_mode(self, mode: str):
+        if self.armature.mode != mode:
+            edited = self.armature.mode == "EDIT"
+            bpy.ops.object.mode_set(mode=mode)
+            self.mode_switches += 1
+            if edited:
+                # edit bones were just written back to the bones
+                RigDescriptor.invalidate(self.data)
+                BoneIndex.invalidate(self.data)
+
+    def edit_bones(self):
+        """Enter edit mode only if needed, batch all edit-mode work between pose steps"""
+        self.set_mode("EDIT")
+        return self.data.edit_bones
+
+    def pose_bones(self):
+        """Leave edit mode only if needed, so new/removed bones are synced to the pose"""
+        if self.armature.mode == "EDIT":
+            self.set_mode("POSE")
+        return self.armature.pose.bones
+
+
+def duplicate_bones(session: ArmatureSession, bone_names):
+    """Duplicate specified bones in the armature"""
+    edit_bones = session.edit_bones()
+    collections = session.data.collections
+    if "IK" not in collections:
+        ik_collection = collections.new("IK")
     else:
-        ik_collection = armature.data.collections["IK"]
+        ik_collection = collections["IK"]
     dup_bone_names = []
     for bone_name in bone_names:
-        if bone_name in armature.data.edit_bones:
-            original_bone = armature.data.edit_bones[bone_name]
-            new_bone = armature.data.edit_bones.new(original_bone.name + ".IK")
+        if bone_name in edit_bones:
+            original_bone = edit_bones[bone_name]
+            new_bone = edit_bones.new(original_bone.name + ".IK")
             dup_bone_names.append(new_bone.name)
             ik_collection.assign(new_bone)
             new_bone.length = original_bone.length
@@ -77,34 +225,23 @@ def duplicate_bones(armature_name, bone_names):
         else:
             Log.error(f"Bone named '{bone_name}' not found.")
 
-    bpy.ops.object.mode_set(mode="OBJECT")
     Log.debug(f"BONES DUPLICATED: '{dup_bone_names}'")
     return dup_bone_names
 
 
-def add_constraints(armature_name, bone_names, target_names, no_scale=False):
+def add_constraints(session: ArmatureSession, bone_names, target_names, no_scale=False):
     """Add constraints to the duplicated bones"""
-    bpy.ops.object.mode_set(mode="OBJECT")
-    armature = bpy.data.objects.get(armature_name)
-    if not armature:
-        Log.error("Armature not found.")
-        return
-
-    bpy.context.view_layer.objects.active = armature
-    armature.select_set(True)
-    bpy.ops.object.mode_set(mode="POSE")
-
+    pose_bones = session.pose_bones()
     for bone_name, target_name in zip(bone_names, target_names):
-        bone = armature.pose.bones.get(bone_name)
+        bone = pose_bones.get(bone_name)
         if bone:
             for t in (
                 ["COPY_LOCATION", "COPY_ROTATION"] if no_scale else ["COPY_TRANSFORMS"]
             ):
-                add_constraint(bone, t, armature, target_name)
+                add_constraint(bone, t, session.armature, target_name)
         else:
             Log.error(f"Bone named '{bone_name}' not found in the armature.")
 
-    bpy.ops.object.mode_set(mode="OBJECT")
     Log.debug("successfully added constraints")
 
 
@@ -115,70 +252,323 @@ def add_constraint(bone: bpy.types.PoseBone, type: str, armature, bone_name):
     return con
 
 
-def bake_animation_to_keyframes(
-    armature_name, bone_names, frame_start, frame_end, clear_parents=True
-):
-    # Bake animation to keyframes for the specified bones
-    bpy.ops.object.mode_set(mode="OBJECT")
-    armature = bpy.data.objects.get(armature_name)
-    if not armature:
-        Log.error("Armature not found.")
-        return
+def ensure_action(armature: bpy.types.Object) -> bpy.types.Action:
+    """Return the current action of the armature, create one if missing"""
+    if not armature.animation_data:
+        armature.animation_data_create()
+    if not armature.animation_data.action:
+        armature.animation_data.action = bpy.data.actions.new(armature.name + "Action")
+    return armature.animation_data.action
+
+
+HANDLE_TYPES = {"FREE": 0, "AUTO": 1, "VECTOR": 2, "ALIGNED": 3, "AUTO_CLAMPED": 4}
+KEY_ATTRIBUTES = {
+    # keyframe point property: number of components
+    "co": 2,
+    "handle_left": 2,
+    "handle_right": 2,
+    "interpolation": 1,
+    "handle_left_type": 1,
+    "handle_right_type": 1,
+}
 
-    bpy.context.view_layer.objects.active = armature
-    armature.select_set(True)
-    bpy.ops.object.mode_set(mode="POSE")
-    bpy.ops.pose.select_all(action="DESELECT")
 
+def read_matrices(collection, prop: str):
+    """Read a 4x4 matrix property of every item in a bpy collection with one `foreach_get`"""
+    buffer = np.empty(len(collection) * 16, dtype=np.float32)
+    collection.foreach_get(prop, buffer)
+    # bpy matrices are flattened column-major
+    return buffer.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+
+
+def read_key_attributes(points, props=KEY_ATTRIBUTES):
+    """{prop: array} of the keyframe points, one `foreach_get` per attribute"""
+    out = {}
+    for prop in props:
+        size = KEY_ATTRIBUTES[prop]
+        buffer = np.empty(
+            len(points) * size, dtype=np.float32 if size > 1 else np.int32
+        )
+        points.foreach_get(prop, buffer)
+        out[prop] = buffer.reshape(-1, size).astype(np.float64) if size > 1 else buffer
+    return out
+
+
+def write_fcurve(
+    fcurve: bpy.types.FCurve, frames, values, interpolation="BEZIER", handles=None
+):
+    """Fill the F-curve with (frames, values) in one buffer write per key attribute.
+    `handles` is an optional (left, right) pair of (keys, 2) arrays kept as aligned handles,
+    otherwise handles are auto clamped. Existing keys inside the written frame range are
+    replaced, keys outside of it are kept."""
+    points = fcurve.keyframe_points
+    co = np.column_stack([frames, values])
+    handle_type = HANDLE_TYPES["ALIGNED" if handles else "AUTO_CLAMPED"]
+    keys = {
+        "co": co,
+        "handle_left": handles[0] if handles else co,
+        "handle_right": handles[1] if handles else co,
+        "interpolation": np.full(len(co), INTERPOLATION[interpolation]),
+        "handle_left_type": np.full(len(co), handle_type),
+        "handle_right_type": np.full(len(co), handle_type),
+    }
+    if len(points):
+        old = read_key_attributes(points)
+        keep = (old["co"][:, 0] < co[0, 0]) | (old["co"][:, 0] > co[-1, 0])
+        if keep.any():
+            keys = {k: np.concatenate([old[k][keep], v]) for k, v in keys.items()}
+            order = np.argsort(keys["co"][:, 0], kind="stable")
+            keys = {k: v[order] for k, v in keys.items()}
+    profile_count("keys", len(keys["co"]))
+    set_keys(fcurve, keys)
+
+
+def set_keys(fcurve: bpy.types.FCurve, keys: dict[str, np.ndarray]):
+    """Replace all keys of the F-curve by `read_key_attributes` arrays"""
+    points = fcurve.keyframe_points
+    points.clear()
+    points.add(len(keys["co"]))
+    for prop, array in keys.items():
+        dtype = np.float32 if KEY_ATTRIBUTES[prop] > 1 else np.int32
+        points.foreach_set(prop, array.astype(dtype).ravel())
+    fcurve.update()
+
+
+BONE_PATH = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]')
+
+
+def bone_path(bone_name: str, prop: str):
+    return f'pose.bones["{bpy.utils.escape_identifier(bone_name)}"].{prop}'
+
+
+class FCurveIndex:
+    """F-curves of an action keyed by bone name and by (data_path, array_index),
+    built once by parsing every `data_path` instead of scanning the action per lookup"""
+
+    def __init__(self, action: bpy.types.Action):
+        self.action = action
+        self.bones: dict[str, list[bpy.types.FCurve]] = {}
+        self.channels: dict[tuple[str, int], bpy.types.FCurve] = {}
+        for fcurve in action.fcurves:
+            self._add(fcurve)
+
+    def _add(self, fcurve: bpy.types.FCurve):
+        self.channels[(fcurve.data_path, fcurve.array_index)] = fcurve
+        match = BONE_PATH.match(fcurve.data_path)
+        if match:
+            bone_name = re.sub(r"\\(.)", r"\1", match.group(1))
+            self.bones.setdefault(bone_name, []).append(fcurve)
+
+    def find(self, data_path: str, index=0):
+        return self.channels.get((data_path, index))
+
+    def ensure(self, data_path: str, index=0, group: str = ""):
+        fcurve = self.find(data_path, index)
+        if not fcurve:
+            fcurve = self.action.fcurves.new(data_path, index=index, action_group=group)
+            self._add(fcurve)
+        return fcurve
+
+    def remove_bones(self, bone_names):
+        """Remove every F-curve of the bones, linear in the number of removed curves"""
+        fcurves = self.action.fcurves
+        removed = 0
+        for bone_name in bone_names:
+            for fcurve in self.bones.pop(bone_name, ()):
+                del self.channels[(fcurve.data_path, fcurve.array_index)]
+                fcurves.remove(fcurve)
+                removed += 1
+        return removed
+
+
+def write_channels(
+    action: bpy.types.Action,
+    frames,
+    channels,
+    interpolation="BEZIER",
+    index: FCurveIndex | None = None,
+):
+    """Write {bone_name: {prop: (frames, n)}} channel arrays into the action, one bulk fill per F-curve"""
+    index = index or FCurveIndex(action)
+    frames = np.asarray(frames, dtype=np.float32)
+    for bone_name, props in channels.items():
+        for prop, values in props.items():
+            data_path = bone_path(bone_name, prop)
+            for i in range(values.shape[1]):
+                fcurve = index.ensure(data_path, i, group=bone_name)
+                write_fcurve(fcurve, frames, values[:, i], interpolation)
+
+
+class ActionBackup:
+    """The keys of the bones' F-curves in an action before a bake writes to them, as arrays:
+    only the curves a bake touches are kept, not a copy of the action. `restore` puts them back,
+    removes the curves the bake added and resets the stored source hashes."""
+
+    def __init__(self, action: bpy.types.Action, bone_names):
+        self.action = action
+        self.bone_names = list(bone_names)
+        index = FCurveIndex(action)
+        self.keys = {
+            (fc.data_path, fc.array_index): read_key_attributes(fc.keyframe_points)
+            for name in self.bone_names
+            for fc in index.bones.get(name, ())
+        }
+        self.hashes = action.get(HASH_PROPERTY)
+
+    def restore(self):
+        if self.hashes is None:
+            self.action.pop(HASH_PROPERTY, None)
+        else:
+            self.action[HASH_PROPERTY] = self.hashes
+        index = FCurveIndex(self.action)
+        restored = 0
+        for name in self.bone_names:
+            for fcurve in index.bones.get(name, ()):
+                keys = self.keys.get((fcurve.data_path, fcurve.array_index))
+                if keys is None:
+                    self.action.fcurves.remove(fcurve)
+                else:
+                    set_keys(fcurve, keys)
+                    restored += 1
+        Log.debug(f"restored {restored} F-curves of '{self.action.name}'")
+
+
+class ActionStage:
+    """Windowed bake into `action`: every window is keyed straight into it, next to the keys of the
+    previous windows, with rotations continuing across window boundaries. Rolling back is up to
+    the caller's `ActionBackup`."""
+
+    # rotation kind of a channel, for `rotations_compatible` across windows
+    ROTATION_MODES = {
+        "rotation_quaternion": "QUATERNION",
+        "rotation_euler": "XYZ",
+        "rotation_axis_angle": "AXIS_ANGLE",
+    }
+
+    def __init__(self, action: bpy.types.Action):
+        self.action = action
+        self.index = FCurveIndex(action)
+        self.last: dict[tuple[str, str], np.ndarray] = {}
+
+    def write(self, frames, channels: dict[str, dict[str, np.ndarray]]):
+        """Key one window of `write_channels` input, rotations continue from the previous window"""
+        for bone_name, props in channels.items():
+            for prop, values in props.items():
+                mode = self.ROTATION_MODES.get(prop)
+                previous = self.last.get((bone_name, prop))
+                if mode and previous is not None:
+                    props[prop] = values = rotations_compatible(values, previous, mode)
+                self.last[(bone_name, prop)] = values[-1]
+        write_channels(self.action, frames, channels, index=self.index)
+
+
+def bake_windows(frame_start, frame_end, step=1.0, window=0):
+    """(start, end) of consecutive windows of at most `window` samples over the sample grid,
+    the whole range when `window` is 0"""
+    frames = sample_frames(frame_start, frame_end, step)
+    window = window or len(frames)
+    return [
+        (float(frames[lo]), float(frames[min(lo + window, len(frames)) - 1]))
+        for lo in range(0, len(frames), window)
+    ]
+
+
+def clear_constraints(armature: bpy.types.Object, bone_names):
+    """Remove all constraints of the specified pose bones"""
     for bone_name in bone_names:
         bone = armature.pose.bones.get(bone_name)
+        if not bone:
+            continue
+        for con in list(bone.constraints):
+            bone.constraints.remove(con)
+
+
+def set_frame(scene: bpy.types.Scene, frame: float):
+    """`Scene.frame_set` for fractional frames, the fraction is evaluated as subframe"""
+    whole = math.floor(frame)
+    scene.frame_set(whole, subframe=frame - whole)
+
+
+def bake_animation_to_keyframes(
+    session: ArmatureSession,
+    bone_names,
+    frame_start,
+    frame_end,
+    continuous=False,
+    step=1.0,
+    stage: ActionStage | None = None,
+):
+    """Bake the visual transforms of the specified bones in a single pass over the frame range,
+    sampled and keyed every `step` frames (fractions are evaluated as subframes).
+    Yield once per evaluated frame, keys are written after the last frame, or to `stage`.
+    `continuous` keeps the new rotations continuous with keys already before the range.
+    """
+    armature = session.armature
+    pose_bones = session.pose_bones()
+    bones: list[bpy.types.PoseBone] = []
+    for bone_name in bone_names:
+        bone = pose_bones.get(bone_name)
         if bone:
-            armature.data.bones[bone_name].select = True
+            bones.append(bone)
         else:
             Log.error(f"Bone named '{bone_name}' not found.")
-
-    Log.debug("start bake command")
-    # TODO: if dup_bone_names is already dup, don't use current action by default
-    pg = Progress(frame_start, frame_end)
-    for i in range(frame_start, frame_end + 1):
-        bpy.ops.nla.bake(
-            frame_start=i,
-            frame_end=i,
-            only_selected=True,
-            visual_keying=True,
-            clear_constraints=False,
-            clear_parents=False,
-            use_current_action=True,
-            bake_types={"POSE"},
-        )
-        pg.update()
-        yield
-    bpy.ops.nla.bake(
-        frame_start=0,
-        frame_end=0,
-        only_selected=True,
-        clear_constraints=True,
-        use_current_action=True,
-        bake_types={"POSE"},
-        clear_parents=clear_parents,
-    )
-    bpy.ops.object.mode_set(mode="OBJECT")
+    bone_names = [b.name for b in bones]
+
+    Log.debug("start bake")
+    scene = bpy.context.scene
+    frame_current, subframe = scene.frame_current, scene.frame_subframe
+    frames = sample_frames(frame_start, frame_end, step)
+    matrices = {name: [] for name in bone_names}
+    pg = Progress(frame_start, frame_end, step)
+    try:
+        for frame in frames:
+            time_frame = time.perf_counter()
+            set_frame(scene, frame)
+            for bone in bones:
+                matrices[bone.name].append(
+                    armature.convert_space(
+                        pose_bone=bone,
+                        matrix=bone.matrix,
+                        from_space="POSE",
+                        to_space="LOCAL",
+                    )
+                )
+            profile_sample("frame", time.perf_counter() - time_frame)
+            pg.update()
+            yield
+    finally:
+        pg.end()
+        scene.frame_set(frame_current, subframe=subframe)
+
+    with profile_span("channels"):
+        channels = {
+            bone.name: matrices_to_channels(
+                np.array(matrices[bone.name], dtype=np.float64), bone.rotation_mode
+            )
+            for bone in bones
+        }
+    if stage:
+        with profile_span("stage keys"):
+            stage.write(frames, channels)
+        return
+    index = FCurveIndex(ensure_action(armature))
+    for bone in bones if continuous else ():
+        rot_path, n = rotation_channel(bone.rotation_mode)
+        fcurves = [index.find(bone_path(bone.name, rot_path), i) for i in range(n)]
+        if all(fc and len(fc.keyframe_points) for fc in fcurves):
+            if fcurves[0].range()[0] < frame_start:  # type: ignore
+                previous = np.array([fc.evaluate(frame_start - 1) for fc in fcurves])  # type: ignore
+                channels[bone.name][rot_path] = rotations_compatible(
+                    channels[bone.name][rot_path], previous, bone.rotation_mode
+                )
+    with profile_span("write keys"):
+        write_channels(ensure_action(armature), frames, channels, index=index)
     Log.debug("successfully bake")
 
 
-def clear_bone_parents(armature_name, bone_names):
+def clear_bone_parents(session: ArmatureSession, bone_names):
     """Clear parents of the specified bones"""
-    bpy.ops.object.mode_set(mode="OBJECT")
-    armature = bpy.data.objects.get(armature_name)
-    if not armature:
-        Log.error("Armature not found.")
-        return
-
-    bpy.context.view_layer.objects.active = armature
-    armature.select_set(True)
-    bpy.ops.object.mode_set(mode="EDIT")
-
-    edit_bones = armature.data.edit_bones
+    edit_bones = session.edit_bones()
     for bone_name in bone_names:
         bone = edit_bones.get(bone_name)
         if bone:
@@ -187,43 +577,1027 @@ def clear_bone_parents(armature_name, bone_names):
         else:
             Log.error(f"Bone named '{bone_name}' not found in the armature.")
 
-    bpy.ops.object.mode_set(mode="OBJECT")
     Log.debug("successfully cleared bone parents")
 
 
-def cleanup(armature_name, duplicated_bone_names):
-    """Clean up duplicated bones"""
-    bpy.ops.object.mode_set(mode="OBJECT")
-    armature = bpy.data.objects.get(armature_name)
-    if not armature:
-        Log.error("Armature not found.")
-        return
-
-    bpy.context.view_layer.objects.active = armature
-    armature.select_set(True)
-
+def cleanup(session: ArmatureSession, duplicated_bone_names, actions=()):
+    """Clean up duplicated bones and their F-curves in the current action and `actions`"""
+    armature = session.armature
+    actions = set(actions)
     if armature.animation_data and armature.animation_data.action:
-        fcurves = armature.animation_data.action.fcurves
-        for fcurve in fcurves:
-            for bone_name in duplicated_bone_names:
-                if fcurve and fcurve.data_path.startswith(
-                    'pose.bones["' + bone_name + '"]'
-                ):
-                    fcurves.remove(fcurve)
-                    break
+        actions.add(armature.animation_data.action)
+    for action in actions:
+        removed = FCurveIndex(action).remove_bones(duplicated_bone_names)
+        Log.debug(f"removed {removed} F-curves from '{action.name}'")
 
-    bpy.ops.object.mode_set(mode="EDIT")
+    edit_bones = session.edit_bones()
     for bone_name in duplicated_bone_names:
-        bone = armature.data.edit_bones.get(bone_name)
+        bone = edit_bones.get(bone_name)
         if bone:
-            armature.data.edit_bones.remove(bone)
+            edit_bones.remove(bone)
         else:
             Log.error(f"Bone named '{bone_name}' not found.")
 
-    bpy.ops.object.mode_set(mode="OBJECT")
     Log.debug("duplicate bones cleaned up")
 
 
+def sample_pose_matrices(
+    armature: bpy.types.Object, bone_names: list[str], frame_start, frame_end, step=1.0
+):
+    """Evaluate the frame range once every `step` frames and read the armature-space (visual)
+    matrices of the bones. Yield once per frame, return a (frames, bones, 4, 4) array.
+    """
+    pose_index = {b.name: i for i, b in enumerate(armature.pose.bones)}
+    indices = [pose_index[name] for name in bone_names]
+    scene = bpy.context.scene
+    frame_current, subframe = scene.frame_current, scene.frame_subframe
+    frames = sample_frames(frame_start, frame_end, step)
+    world = np.empty((len(frames), len(indices), 4, 4))
+    pg = Progress(frame_start, frame_end, step)
+    try:
+        for f, frame in enumerate(frames):
+            time_frame = time.perf_counter()
+            set_frame(scene, frame)
+            world[f] = read_matrices(armature.pose.bones, "matrix")[indices]
+            profile_sample("frame", time.perf_counter() - time_frame)
+            pg.update()
+            yield
+    finally:
+        pg.end()
+        scene.frame_set(frame_current, subframe=subframe)
+    return world
+
+
+def read_keyframes(fcurve: bpy.types.FCurve):
+    """(co, handle_left, handle_right, interpolation) arrays of the F-curve's keys"""
+    props = ("co", "handle_left", "handle_right", "interpolation")
+    keys = read_key_attributes(fcurve.keyframe_points, props)
+    return tuple(keys[prop] for prop in props)
+
+
+class FCurveSampler:
+    """Evaluate an F-curve at many frames at once, keys are read a single time.
+    Curves with modifiers or easing interpolations fall back to `FCurve.evaluate`."""
+
+    def __init__(self, fcurve: bpy.types.FCurve):
+        self.fcurve = fcurve
+        self.keys = read_keyframes(fcurve)
+        self.vectorized = not fcurve.modifiers and np.all(
+            self.keys[3] <= INTERPOLATION["BEZIER"]
+        )
+
+    def __call__(self, frames: np.ndarray):
+        if not self.vectorized:
+            return np.array([self.fcurve.evaluate(f) for f in frames])
+        return evaluate_keys(*self.keys, frames, self.fcurve.extrapolation)
+
+
+def bone_samplers(index: FCurveIndex, pose_bone: bpy.types.PoseBone):
+    """(rotation_mode, {prop: [sampler or constant per array index]}) of the bone's transform
+    channels, unkeyed and muted channels keep the current pose value"""
+    rot_path, _ = rotation_channel(pose_bone.rotation_mode)
+    channels = {}
+    for prop in ("location", rot_path, "scale"):
+        default = tuple(getattr(pose_bone, prop))
+        fcurves = [
+            index.find(bone_path(pose_bone.name, prop), i) for i in range(len(default))
+        ]
+        channels[prop] = [
+            (
+                FCurveSampler(fc)
+                if fc and not fc.mute and len(fc.keyframe_points)
+                else value
+            )
+            for fc, value in zip(fcurves, default)
+        ]
+    return pose_bone.rotation_mode, channels
+
+
+def sample_channels(channels: dict[str, list], frames: np.ndarray):
+    """{prop: (frames, n)} values of `bone_samplers` channels at the frames"""
+    return {
+        prop: np.column_stack(
+            [c(frames) if callable(c) else np.full(len(frames), c) for c in curves]
+        )
+        for prop, curves in channels.items()
+    }
+
+
+RIG_PROPERTY = "fktoik_rig"
+
+
+class RigDescriptor:
+    """The skeleton of an armature as arrays in `Armature.bones` order: names and their indices,
+    parent indices (-1 for roots), armature-space rest matrices and lengths.
+    Kept in memory until the bones change (see `on_depsgraph_update`) and stored on the armature
+    data under `RIG_PROPERTY` with a fingerprint of the skeleton, so a reloaded file only reads
+    the bones in bulk to check it, instead of resolving every bone's parent again."""
+
+    cache: dict[int, "RigDescriptor"] = {}
+
+    def __init__(self, names, parents, rest, lengths, fingerprint: str):
+        self.names: list[str] = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.parents: np.ndarray = parents
+        self.rest: np.ndarray = rest
+        self.lengths: np.ndarray = lengths
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def scan(data: bpy.types.Armature):
+        """(names, rest, lengths, fingerprint) of the bones, everything but the names is read
+        with `foreach_get`. The parent-relative heads are hashed too, so reparenting a bone
+        changes the fingerprint even when its rest matrix stays the same."""
+        bones = data.bones
+        names = [b.name for b in bones]
+        rest = read_matrices(bones, "matrix_local")
+        lengths = np.empty(len(bones), dtype=np.float32)
+        bones.foreach_get("length", lengths)
+        heads = np.empty(len(bones) * 3, dtype=np.float32)
+        bones.foreach_get("head", heads)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("\0".join(names).encode())
+        for array in (rest, lengths, heads):
+            digest.update(array.tobytes())
+        return names, rest, lengths.astype(np.float64), digest.hexdigest()
+
+    @classmethod
+    def of(cls, armature: bpy.types.Object | bpy.types.Armature) -> "RigDescriptor":
+        data = armature.data if isinstance(armature, bpy.types.Object) else armature
+        key = data.as_pointer()
+        rig = cls.cache.get(key)
+        if rig is not None and len(rig.names) == len(data.bones):
+            return rig
+        names, rest, lengths, fingerprint = cls.scan(data)
+        stored = data.get(RIG_PROPERTY)
+        if stored and stored.get("fingerprint") == fingerprint:
+            parents = np.array(stored["parents"], dtype=int).reshape(len(names))
+        else:
+            index = {name: i for i, name in enumerate(names)}
+            parents = np.array(
+                [index[b.parent.name] if b.parent else -1 for b in data.bones],
+                dtype=int,
+            )
+            if not data.library:
+                data[RIG_PROPERTY] = {
+                    "fingerprint": fingerprint,
+                    "parents": parents.tolist(),
+                }
+            Log.debug(f"rig descriptor of '{data.name}' rebuilt")
+        rig = cls.cache[key] = cls(names, parents, rest, lengths, fingerprint)
+        return rig
+
+    @classmethod
+    def invalidate(cls, data: bpy.types.Armature | None = None):
+        if data is None:
+            cls.cache.clear()
+        else:
+            cls.cache.pop(data.as_pointer(), None)
+
+    def indices(self, names: Sequence[str]):
+        return np.array([self.index[name] for name in names], dtype=int)
+
+    def chain(self, names: Sequence[str]):
+        """(chain indices, parent indices into the chain, position of every bone in the chain)
+        of the bones plus all of their ancestors, see `chain_subset`"""
+        return chain_subset(self.parents, self.indices(names))
+
+    def ancestry(self, name: str):
+        """Indices of the bone then its ancestors up to the root"""
+        out = []
+        i = self.index[name]
+        while i >= 0:
+            out.append(i)
+            i = self.parents[i]
+        return out
+
+
+def kinematic_chain(armature: bpy.types.Object, bone_names: list[str]):
+    """The bones plus all of their ancestors with parent indices into it, from the `RigDescriptor`"""
+    rig = RigDescriptor.of(armature)
+    chain, parents, _ = rig.chain(bone_names)
+    return [rig.names[i] for i in chain], parents
+
+
+def kinematics_unsupported(armature: bpy.types.Object, chain_names: list[str]):
+    """Why the pose of the chain can't be computed from the action alone, empty if it can"""
+    ad = armature.animation_data
+    if armature.data.pose_position != "POSE":
+        return "armature in rest position"
+    if not (ad and ad.action):
+        return "no action"
+    if ad.use_tweak_mode or (ad.use_nla and any(not t.mute for t in ad.nla_tracks)):
+        return "NLA tracks"
+    if ad.action_influence < 1 or ad.action_blend_type != "REPLACE":
+        return "action blending"
+    for pose_bone in armature.pose.bones:
+        if any(not c.mute and c.influence > 0 for c in pose_bone.constraints):
+            return f"constraints on '{pose_bone.name}'"
+    chain = set(chain_names)
+    for fcurve in ad.drivers:
+        match = BONE_PATH.match(fcurve.data_path)
+        if match and re.sub(r"\\(.)", r"\1", match.group(1)) in chain:
+            return f"drivers on '{fcurve.data_path}'"
+    for bone_name in chain_names:
+        bone = armature.data.bones[bone_name]
+        if (
+            not bone.use_inherit_rotation
+            or bone.inherit_scale != "FULL"
+            or not bone.use_local_location
+        ):
+            return f"non-default inheritance on '{bone_name}'"
+    return ""
+
+
+def evaluate_pose_kinematics(
+    armature: bpy.types.Object,
+    bone_names: list[str],
+    frame_start,
+    frame_end,
+    step=1.0,
+    chunk=256,
+):
+    """Same result as `sample_pose_matrices` without `frame_set`: the chain's F-curves are evaluated
+    in batch and the armature-space matrices computed with `forward_kinematics`, ancestors once per frame.
+    Yield once per chunk of frames, return a (frames, bones, 4, 4) array."""
+    rig = RigDescriptor.of(armature)
+    chain, parents, selected = rig.chain(bone_names)
+    chain_names = [rig.names[i] for i in chain]
+    rest = rig.rest[chain]
+
+    index = FCurveIndex(armature.animation_data.action)
+    samplers = [
+        bone_samplers(index, armature.pose.bones[bone_name])
+        for bone_name in chain_names
+    ]
+    # Blender ignores the location of connected bones, their head stays on the parent's tail
+    connected = np.array(
+        [armature.data.bones[bone_name].use_connect for bone_name in chain_names],
+        dtype=bool,
+    )
+
+    frames = sample_frames(frame_start, frame_end, step)
+    world = np.empty((len(frames), len(bone_names), 4, 4))
+    pg = Progress(frame_start, frame_end, step)
+    try:
+        for lo in range(0, len(frames), chunk):
+            time_chunk = time.perf_counter()
+            part = frames[lo : lo + chunk]
+            basis = np.empty((len(part), len(chain_names), 4, 4))
+            for b, (rotation_mode, channels) in enumerate(samplers):
+                basis[:, b] = channels_to_matrices(
+                    sample_channels(channels, part), rotation_mode
+                )
+            basis[:, connected, :3, 3] = 0
+            world[lo : lo + chunk] = forward_kinematics(rest, parents, basis)[
+                :, selected
+            ]
+            # per frame latency, comparable with the scene sampling
+            elapsed = time.perf_counter() - time_chunk
+            for _ in part:
+                profile_sample("frame", elapsed / len(part))
+            pg.update(len(part))
+            yield
+    finally:
+        pg.end()
+    return world
+
+
+def decimate_keys(
+    armature: bpy.types.Object,
+    bone_names: list[str],
+    frame_start,
+    frame_end,
+    distance: float,
+    angle: float,
+    step=1.0,
+):
+    """Post-bake stage: replace the dense keys of the bones in the frame range with the fewest
+    Bezier keys staying within `distance` for location/scale and `angle` (radians) for rotation.
+    The errors are measured on the bones' local channels, they are only armature-space errors for
+    bones without a parent: pass only bones that are, or are about to be, unparented.
+    `step` is the spacing of the baked keys. Yield once per bone."""
+    index = FCurveIndex(ensure_action(armature))
+    frames = sample_frames(frame_start, frame_end, step)
+    total = kept = 0
+    for bone_name in bone_names:
+        pose_bone = armature.pose.bones.get(bone_name)
+        if not pose_bone:
+            continue
+        rot_path, _ = rotation_channel(pose_bone.rotation_mode)
+        for prop, tolerance, error in (
+            ("location", distance, distance_error),
+            (rot_path, angle, rotation_error(pose_bone.rotation_mode)),
+            ("scale", distance, max_error),
+        ):
+            size = len(getattr(pose_bone, prop))
+            fcurves = [index.find(bone_path(bone_name, prop), i) for i in range(size)]
+            if not all(fcurves):
+                continue
+            values = np.column_stack([FCurveSampler(fc)(frames) for fc in fcurves])
+            keys, handle_left, handle_right = decimate_samples(
+                frames, values, error, tolerance
+            )
+            for c, fcurve in enumerate(fcurves):
+                write_fcurve(
+                    fcurve,
+                    frames[keys],
+                    values[keys, c],
+                    handles=(handle_left[:, c], handle_right[:, c]),
+                )
+            total += len(frames) * size
+            kept += len(keys) * size
+        yield
+    Log.debug(f"decimated {total} keys to {kept}")
+
+
+def sample_pose_sharded(
+    armature: bpy.types.Object,
+    bone_names: list[str],
+    frame_start,
+    frame_end,
+    shards: int,
+    step=1.0,
+):
+    """`sample_pose_matrices` split into `shards` frame ranges, each evaluated by its own
+    background Blender process on a copy of the file and returned as a compact (frames, bones, 3, 4)
+    float32 array. Yield while waiting, return the merged (frames, bones, 4, 4) array.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="fktoik_")
+    blend = os.path.join(tmpdir, "scene.blend")
+    bpy.ops.wm.save_as_mainfile(filepath=blend, copy=True)
+    # names go through a file: they may start with "-", and thousands of bones overflow argv
+    spec = os.path.join(tmpdir, "bones.json")
+    with open(spec, "w") as f:
+        json.dump(dict(armature=armature.name, bones=bone_names), f)
+    frames = sample_frames(frame_start, frame_end, step)
+    bounds = np.unique(np.linspace(0, len(frames), shards + 1).astype(int))
+    workers = []
+    pg = Progress(frame_start, frame_end, step)
+    try:
+        for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            output, log = os.path.join(tmpdir, f"{i}.npy"), os.path.join(
+                tmpdir, f"{i}.log"
+            )
+            cmd = [bpy.app.binary_path, "-b", "--factory-startup", blend]
+            cmd += ["--python-exit-code", "1", "-P", __file__, "--", "shard"]
+            # plain floats, NumPy 2 scalars repr as "np.float64(...)"
+            cmd += ["--step", str(float(step)), spec, output]
+            cmd += [str(float(frames[lo])), str(float(frames[hi - 1]))]
+            with open(log, "w") as f:
+                proc = subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT)
+            workers.append((proc, lo, hi, output, log))
+        Log.debug(f"sampling {frame_start}-{frame_end} in {len(workers)} processes")
+
+        pending = list(workers)
+        while pending:
+            for worker in list(pending):
+                proc, lo, hi, output, log = worker
+                if proc.poll() is None:
+                    continue
+                pending.remove(worker)
+                if proc.returncode:
+                    with open(log) as f:
+                        tail = f.read()[-2000:]
+                    raise RuntimeError(
+                        f"shard {frames[lo]:g}-{frames[hi - 1]:g} failed:\n{tail}"
+                    )
+                pg.update(hi - lo)
+            yield
+            time.sleep(0.01)
+
+        world = np.zeros((len(frames), len(bone_names), 4, 4))
+        world[..., 3, 3] = 1
+        for proc, lo, hi, output, log in workers:
+            world[lo:hi, :, :3] = np.load(output)
+    finally:
+        pg.end()
+        for proc, *_ in workers:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return world
+
+
+def sample_visual_matrices(
+    armature: bpy.types.Object,
+    bone_names: list[str],
+    chain_names: list[str],
+    frame_start,
+    frame_end,
+    shards=1,
+    step=1.0,
+):
+    """Armature-space matrices of the bones every `step` frames by the cheapest path: forward
+    kinematics over the action when nothing else affects the chain, otherwise scene sampling,
+    sharded if `shards` > 1
+    """
+    reason = kinematics_unsupported(armature, chain_names)
+    if reason and shards > 1:
+        Log.debug(f"sampling the scene in {shards} shards: {reason}")
+        with profile_span("sample shards"):
+            return (
+                yield from sample_pose_sharded(
+                    armature, bone_names, frame_start, frame_end, shards, step
+                )
+            )
+    if reason:
+        Log.debug(f"sampling the scene: {reason}")
+        with profile_span("sample scene"):
+            return (
+                yield from sample_pose_matrices(
+                    armature, bone_names, frame_start, frame_end, step
+                )
+            )
+    Log.debug(f"forward kinematics over {len(chain_names)} bones")
+    with profile_span("forward kinematics"):
+        return (
+            yield from evaluate_pose_kinematics(
+                armature, bone_names, frame_start, frame_end, step
+            )
+        )
+
+
+def backup_takes(armature: bpy.types.Object, takes, bone_names):
+    """`ActionBackup` of the bones in every take's action, taken before anything is baked"""
+    backups = []
+    for action, _, _ in takes:
+        with use_action(armature, action):
+            backups.append(ActionBackup(ensure_action(armature), bone_names))
+    return backups
+
+
+def bake_direct(
+    session: ArmatureSession,
+    bone_names,
+    takes: list[tuple[bpy.types.Action | None, int, int]],
+    no_scale=False,
+    shards=1,
+    decimate: tuple[float, float] | None = None,
+    step=1.0,
+    window=0,
+):
+    """Constraint-free bake used by `replace`: evaluate each take's frame range once every `step`
+    frames, then key the visual transforms of the bones as unparented local channels computed in
+    batch as `rest⁻¹ @ world`.
+    `takes` are (action, frame_start, frame_end), `None` for the current action. Every action is
+    evaluated with the original hierarchy and constraints, which are cleared once after the last one.
+    `window` bakes at most that many samples at a time through an `ActionStage`.
+    """
+    armature = session.armature
+    pose_bones = session.pose_bones()
+    missing = [name for name in bone_names if name not in pose_bones]
+    for bone_name in missing:
+        Log.error(f"Bone named '{bone_name}' not found.")
+    bone_names = [name for name in bone_names if name not in missing]
+
+    rig = RigDescriptor.of(armature)
+    chain, _, _ = rig.chain(bone_names)
+    chain_names = [rig.names[i] for i in chain]
+    rest = rig.rest[rig.indices(bone_names)]
+    rotation_modes = [pose_bones[name].rotation_mode for name in bone_names]
+    backups = backup_takes(armature, takes, bone_names)
+    try:
+        for (action, frame_start, frame_end), backup in zip(takes, backups):
+            target = backup.action
+            stage = ActionStage(target) if window else None
+            Log.debug(f"start direct bake of '{target.name}'")
+            with use_action(armature, action):
+                for lo, hi in bake_windows(frame_start, frame_end, step, window):
+                    world = yield from sample_visual_matrices(
+                        armature, bone_names, chain_names, lo, hi, shards, step
+                    )
+                    with profile_span("unparent"):
+                        local = unparent(rest, world, no_scale=no_scale)
+                        channels = {
+                            name: matrices_to_channels(
+                                local[:, b], mode, no_scale=no_scale
+                            )
+                            for b, (name, mode) in enumerate(
+                                zip(bone_names, rotation_modes)
+                            )
+                        }
+                    frames = sample_frames(lo, hi, step)
+                    if stage:
+                        with profile_span("stage keys"):
+                            stage.write(frames, channels)
+                    else:
+                        with profile_span("write keys"):
+                            write_channels(target, frames, channels)
+                if decimate:
+                    with profile_span("decimate"):
+                        yield from decimate_keys(
+                            armature,
+                            bone_names,
+                            frame_start,
+                            frame_end,
+                            *decimate,
+                            step=step,
+                        )
+    except BaseException:
+        # cancelled (`GeneratorExit`) or failed: the bones keep their parents and constraints
+        # until after the last take, so every take gets its previous keys back
+        Log.warning("bake interrupted, restoring the previous keys")
+        for backup in backups:
+            backup.restore()
+        raise
+    # the baked keys already hold the constraints' result,
+    # and are only valid once the bones no longer inherit from their parents
+    with profile_span("clear constraints"):
+        clear_constraints(armature, bone_names)
+    with profile_span("clear parents"):
+        clear_bone_parents(session, bone_names)
+    Log.debug("successfully direct bake")
+
+
+def retarget_action(dst: bpy.types.Object, action: bpy.types.Action | None):
+    """Action of `dst` receiving the retarget of the source `action`: its current one for the
+    current action, else one named after both, kept with a fake user"""
+    if action is None:
+        return ensure_action(dst)
+    name = f"{action.name}.{dst.name}"
+    target = bpy.data.actions.get(name) or bpy.data.actions.new(name)
+    target.use_fake_user = True
+    return target
+
+
+def bake_retarget(
+    session: ArmatureSession,
+    bone_names,
+    dst: bpy.types.Object,
+    dst_bone_names,
+    takes: list[tuple[bpy.types.Action | None, int, int]],
+    no_scale=False,
+    shards=1,
+    decimate: tuple[float, float] | None = None,
+    step=1.0,
+    window=0,
+):
+    """Bake the source bones straight onto the paired `dst_bone_names` of another armature, with a
+    single evaluation pass of the source per take. The pairs' rest offsets and the object space
+    change are computed once, `retarget` turns the sampled source poses into destination keys in
+    batch. The source armature is left untouched, each take is keyed into a `retarget_action` of
+    `dst`, which are returned, the last one stays assigned.
+    Only destination bones without a parent are decimated: the others keep their parents, whose
+    motion would add up the local errors of the whole chain."""
+    armature = session.armature
+    pairs = []
+    for src_name, dst_name in zip(bone_names, dst_bone_names):
+        if src_name not in session.data.bones:
+            Log.error(f"Bone named '{src_name}' not found.")
+        elif dst_name not in dst.data.bones:
+            Log.error(f"Bone named '{dst_name}' not found in '{dst.name}'.")
+        else:
+            pairs.append((src_name, dst_name))
+    src_names = [src_name for src_name, _ in pairs]
+    dst_names = [dst_name for _, dst_name in pairs]
+
+    chain_names, _ = kinematic_chain(armature, src_names)
+    src_rig, dst_rig = RigDescriptor.of(armature), RigDescriptor.of(dst)
+    src_rest = src_rig.rest[src_rig.indices(src_names)]
+    dst_indices = dst_rig.indices(dst_names)
+    dst_rest = dst_rig.rest[dst_indices]
+    # bones outside of the mapping aren't keyed, each pair follows its nearest mapped ancestor
+    position = np.full(len(dst_rig.names), -1)
+    position[dst_indices] = np.arange(len(dst_names))
+    dst_parents = np.full(len(dst_names), -1)
+    for pair, i in enumerate(dst_indices):
+        ancestor = dst_rig.parents[i]
+        while ancestor >= 0 and position[ancestor] < 0:
+            ancestor = dst_rig.parents[ancestor]
+        if ancestor >= 0:
+            dst_parents[pair] = position[ancestor]
+    parent_indices = dst_rig.parents[dst_indices]
+    dst_parent_rest = np.broadcast_to(np.eye(4), dst_rest.shape).copy()
+    has_parent = parent_indices >= 0
+    dst_parent_rest[has_parent] = dst_rig.rest[parent_indices[has_parent]]
+    src_to_dst = np.linalg.inv(np.array(dst.matrix_world)) @ np.array(
+        armature.matrix_world
+    )
+    offsets = retarget_offsets(src_rest, dst_rest, src_to_dst)
+    rotation_modes = [dst.pose.bones[name].rotation_mode for name in dst_names]
+    roots = [name for name, i in zip(dst_names, parent_indices) if i < 0]
+    if decimate and len(roots) < len(dst_names):
+        Log.info(f"only decimating the {len(roots)} destination bones without a parent")
+    if not dst.animation_data:
+        dst.animation_data_create()
+
+    # every target is set up before baking, so that a cancelled or failed bake can undo all takes
+    current = dst.animation_data.action
+    targets, backups, created = [], [], []
+    for action, _, _ in takes:
+        existing = set(bpy.data.actions)
+        target = retarget_action(dst, action)
+        if target not in existing:
+            created.append(target)
+        targets.append(target)
+        backups.append(ActionBackup(target, dst_names))
+    try:
+        for (action, frame_start, frame_end), target in zip(takes, targets):
+            stage = ActionStage(target) if window else None
+            Log.debug(f"start retarget into '{target.name}'")
+            with use_action(armature, action):
+                for lo, hi in bake_windows(frame_start, frame_end, step, window):
+                    world = yield from sample_visual_matrices(
+                        armature, src_names, chain_names, lo, hi, shards, step
+                    )
+                    with profile_span("retarget"):
+                        basis = retarget(
+                            world,
+                            offsets,
+                            dst_rest,
+                            dst_parents,
+                            dst_parent_rest,
+                            src_to_dst,
+                            no_scale=no_scale,
+                        )
+                        channels = {
+                            name: matrices_to_channels(
+                                basis[:, b], mode, no_scale=no_scale
+                            )
+                            for b, (name, mode) in enumerate(
+                                zip(dst_names, rotation_modes)
+                            )
+                        }
+                    frames = sample_frames(lo, hi, step)
+                    if stage:
+                        with profile_span("stage keys"):
+                            stage.write(frames, channels)
+                    else:
+                        with profile_span("write keys"):
+                            write_channels(target, frames, channels)
+            dst.animation_data.action = target
+            if decimate and roots:
+                with profile_span("decimate"):
+                    yield from decimate_keys(
+                        dst, roots, frame_start, frame_end, *decimate, step=step
+                    )
+    except BaseException:
+        Log.warning("retarget interrupted, restoring the target's keys")
+        dst.animation_data.action = current
+        for target, backup in zip(targets, backups):
+            if target not in created:
+                backup.restore()
+        for target in created:
+            bpy.data.actions.remove(target)
+        raise
+    Log.debug(f"successfully retargeted {len(pairs)} bones onto '{dst.name}'")
+    return targets
+
+
+HASH_BLOCK = 16
+HASH_PROPERTY = "fktoik_hashes"
+
+
+def source_hashes(
+    armature: bpy.types.Object,
+    bone_names: list[str],
+    frame_start,
+    frame_end,
+    block=HASH_BLOCK,
+):
+    """{bone: `block_hashes`} over the current action's sampled channels of every bone and its
+    ancestors, seeded with their rest matrices: a block's hash changes when anything the bone's FK
+    motion is keyed from changes in those frames"""
+    chain_names, _ = kinematic_chain(armature, bone_names)
+    index = FCurveIndex(ensure_action(armature))
+    frames = np.arange(frame_start, frame_end + 1, dtype=np.float64)
+    values = {}
+    for name in chain_names:
+        _, channels = bone_samplers(index, armature.pose.bones[name])
+        values[name] = np.column_stack(list(sample_channels(channels, frames).values()))
+    rig = RigDescriptor.of(armature)
+    hashes = {}
+    for name in bone_names:
+        chain = rig.ancestry(name)
+        seed = rig.rest[chain].tobytes()
+        samples = np.column_stack([values[rig.names[i]] for i in chain])
+        hashes[name] = block_hashes(samples, block, seed)
+    return hashes
+
+
+def store_hashes(
+    action: bpy.types.Action, hashes: dict, frame_start, step=1.0, block=HASH_BLOCK
+):
+    """Remember the source hashes of the last bake on the action, merged with other bones'"""
+    stored = json.loads(action.get(HASH_PROPERTY, "{}"))
+    settings = dict(frame_start=frame_start, step=step, block=block)
+    if any(stored.get(k) != v for k, v in settings.items()):
+        stored = dict(settings, bones={})
+    stored["bones"].update(hashes)
+    action[HASH_PROPERTY] = json.dumps(stored)
+
+
+def dirty_ranges(
+    action: bpy.types.Action,
+    hashes: dict,
+    frame_start,
+    frame_end,
+    step=1.0,
+    block=HASH_BLOCK,
+):
+    """{bone: merged (start, end) frame ranges changed since the hashes stored on the action},
+    bones without stored hashes or baked with other settings are dirty over the whole range
+    """
+    stored = json.loads(action.get(HASH_PROPERTY, "{}"))
+    settings = dict(frame_start=frame_start, step=step, block=block)
+    if any(stored.get(k) != v for k, v in settings.items()):
+        stored = {}
+    old = stored.get("bones", {})
+    dirty = {}
+    for name, new in hashes.items():
+        ranges = changed_ranges(old.get(name, []), new, frame_start, frame_end, block)
+        if ranges:
+            dirty[name] = ranges
+    return dirty
+
+
+def rebake_append(
+    session: ArmatureSession,
+    bone_names,
+    dup_bone_names,
+    takes: list[tuple[bpy.types.Action | None, int, int]],
+    no_scale=False,
+    decimate: tuple[float, float] | None = None,
+    step=1.0,
+):
+    """Incremental `bake_append` onto existing duplicates: only the frame ranges whose source
+    channels changed since the last bake are evaluated and rewritten, other keys are kept
+    """
+    armature = session.armature
+    dup = dict(zip(bone_names, dup_bone_names))
+    backups = backup_takes(armature, takes, dup_bone_names)
+    try:
+        for action, start, end in takes:
+            with use_action(armature, action):
+                with profile_span("hash"):
+                    hashes = source_hashes(armature, bone_names, start, end)
+                    dirty = dirty_ranges(
+                        ensure_action(armature), hashes, start, end, step
+                    )
+                # the dirty bones share one pass over the union of their ranges,
+                # starting on the sample grid of the full bake
+                ranges = [
+                    (start + math.ceil((lo - start) / step - 1e-6) * step, hi)
+                    for lo, hi in merge_ranges([r for rs in dirty.values() for r in rs])
+                ]
+                ranges = [(lo, hi) for lo, hi in ranges if lo <= hi]
+                targets = [dup[name] for name in dirty]
+                Log.debug(f"rebaking {len(targets)} bones over {ranges}")
+                if targets:
+                    with profile_span("constraints"):
+                        add_constraints(
+                            session, targets, list(dirty), no_scale=no_scale
+                        )
+                    try:
+                        for lo, hi in ranges:
+                            with profile_span("bake pass"):
+                                yield from bake_animation_to_keyframes(
+                                    session, targets, lo, hi, continuous=True, step=step
+                                )
+                            if decimate:
+                                with profile_span("decimate"):
+                                    yield from decimate_keys(
+                                        armature, targets, lo, hi, *decimate, step=step
+                                    )
+                    finally:
+                        with profile_span("clear constraints"):
+                            clear_constraints(armature, targets)
+                store_hashes(ensure_action(armature), hashes, start, step)
+    except BaseException:
+        Log.warning("rebake interrupted, restoring the previous keys")
+        for backup in backups:
+            backup.restore()
+        raise
+
+
+def bake_append(
+    session: ArmatureSession,
+    bone_names,
+    takes: list[tuple[bpy.types.Action | None, int, int]],
+    no_scale=False,
+    decimate: tuple[float, float] | None = None,
+    incremental=False,
+    step=1.0,
+    window=0,
+):
+    """Bake duplicates of the bones constrained to them for every take every `step` frames,
+    return the duplicates' names.
+    The duplicates and constraints are set up once and removed again if the bake doesn't finish.
+    `incremental` reuses the duplicates of a previous bake and only rebakes what changed since.
+    `window` bakes at most that many samples at a time, see `bake_direct`.
+    """
+    missing = [name for name in bone_names if name not in session.data.bones]
+    for bone_name in missing:
+        Log.error(f"Bone named '{bone_name}' not found.")
+    bone_names = [name for name in bone_names if name not in missing]
+    existing = [name + ".IK" for name in bone_names]
+    if incremental and all(name in session.data.bones for name in existing):
+        yield from rebake_append(
+            session,
+            bone_names,
+            existing,
+            takes,
+            no_scale=no_scale,
+            decimate=decimate,
+            step=step,
+        )
+        return existing
+    with profile_span("duplicate"):
+        dup_bone_names = duplicate_bones(session, bone_names)
+    backups = backup_takes(session.armature, takes, dup_bone_names)
+    try:
+        with profile_span("constraints"):
+            add_constraints(session, dup_bone_names, bone_names, no_scale=no_scale)
+        for (action, start, end), backup in zip(takes, backups):
+            stage = ActionStage(backup.action) if window else None
+            with use_action(session.armature, action):
+                for lo, hi in bake_windows(start, end, step, window):
+                    with profile_span("bake pass"):
+                        yield from bake_animation_to_keyframes(
+                            session, dup_bone_names, lo, hi, step=step, stage=stage
+                        )
+                if decimate:
+                    with profile_span("decimate"):
+                        yield from decimate_keys(
+                            session.armature,
+                            dup_bone_names,
+                            start,
+                            end,
+                            *decimate,
+                            step=step,
+                        )
+                with profile_span("hash"):
+                    hashes = source_hashes(session.armature, bone_names, start, end)
+                    store_hashes(backup.action, hashes, start, step)
+        with profile_span("clear constraints"):
+            clear_constraints(session.armature, dup_bone_names)
+    except BaseException:
+        # cancelled (`GeneratorExit`) or failed: don't leave temporary bones or their keys behind
+        Log.warning("bake interrupted, removing the duplicated bones")
+        with profile_span("cleanup"):
+            for backup in backups:
+                backup.restore()
+            cleanup(session, dup_bone_names)
+        raise
+    return dup_bone_names
+
+
+def export_transforms(
+    armature: bpy.types.Object, bone_names, frame_start, frame_end, path: str, step=1.0
+):
+    """Write the keyed local transforms of the bones over the frame range every `step` frames to a
+    float32 transforms container (see `fktoikcore.create_transforms`), sampling the current action
+    one bone at a time"""
+    index = FCurveIndex(ensure_action(armature))
+    bone_names = [name for name in bone_names if name in armature.pose.bones]
+    pose_bones = [armature.pose.bones[name] for name in bone_names]
+    frames = sample_frames(frame_start, frame_end, step)
+    out = create_transforms(
+        path,
+        len(frames),
+        bone_names,
+        [b.rotation_mode for b in pose_bones],
+        frame_start=frame_start,
+        fps=scene_fps() / step,
+        frame_step=step,
+    )
+    for b, pose_bone in enumerate(pose_bones):
+        rotation_mode, channels = bone_samplers(index, pose_bone)
+        out[:, b] = pack_pose(sample_channels(channels, frames), rotation_mode)
+    out.flush()
+    Log.debug(f"exported {len(bone_names)} bones x {len(frames)} frames to {path}")
+
+
+def import_transforms(
+    armature: bpy.types.Object, path: str, action: bpy.types.Action | None = None
+):
+    """Key a transforms container onto the armature's bones with one bulk write per F-curve, into
+    `action` or a new action named after the file. The action is assigned to the armature.
+    """
+    header, pose = read_transforms(path)
+    if action is None:
+        action = bpy.data.actions.new(os.path.splitext(os.path.basename(path))[0])
+    ad = armature.animation_data or armature.animation_data_create()
+    ad.action = action
+    index = FCurveIndex(action)
+    frames = header["frame_start"] + np.arange(len(pose)) * header.get("frame_step", 1)
+    for b, (bone_name, rotation_mode) in enumerate(
+        zip(header["bones"], header["rotation_modes"])
+    ):
+        pose_bone = armature.pose.bones.get(bone_name)
+        if not pose_bone:
+            Log.error(f"Bone named '{bone_name}' not found.")
+            continue
+        pose_bone.rotation_mode = rotation_mode
+        channels = {bone_name: unpack_pose(pose[:, b], rotation_mode)}
+        write_channels(action, frames, channels, index=index)
+    Log.debug(f"imported {len(header['bones'])} bones x {len(pose)} frames from {path}")
+    return action
+
+
+def export_path(path: str, action_name: str, several=False):
+    """`path` with `{action}` replaced by the action name. Without the placeholder, several
+    actions get their name appended to the file name instead of overwriting each other.
+    """
+    if "{action}" in path:
+        return path.replace("{action}", bpy.path.clean_name(action_name))
+    if several:
+        stem, ext = os.path.splitext(path)
+        return f"{stem}_{bpy.path.clean_name(action_name)}{ext}"
+    return path
+
+
+def evaluation_dependencies(armature: bpy.types.Object):
+    """Objects the pose of the armature depends on: parents, constraint and driver targets, recursively"""
+    keep = set()
+    stack = [armature]
+    while stack:
+        obj = stack.pop()
+        if not isinstance(obj, bpy.types.Object) or obj in keep:
+            continue
+        keep.add(obj)
+        stack.append(obj.parent)
+        constraints = list(obj.constraints)
+        if obj.pose:
+            for bone in obj.pose.bones:
+                constraints.extend(bone.constraints)
+        for con in constraints:
+            stack.append(getattr(con, "target", None))
+            stack.append(getattr(con, "pole_target", None))
+            stack.extend(t.target for t in getattr(con, "targets", ()))
+        if obj.animation_data:
+            for fcurve in obj.animation_data.drivers:
+                for var in fcurve.driver.variables:
+                    stack.extend(t.id for t in var.targets)
+    return keep
+
+
+@contextmanager
+def isolate_evaluation(armature: bpy.types.Object, enabled=True):
+    """Disable every object the armature's pose doesn't depend on in the viewport, so
+    `frame_set` only evaluates the rig instead of skinned meshes, modifiers and the rest of the scene
+    """
+    hidden: list[bpy.types.Object] = []
+    if enabled:
+        keep = evaluation_dependencies(armature)
+        for obj in bpy.context.view_layer.objects:
+            if obj in keep or obj.hide_viewport or obj.library:
+                continue
+            obj.hide_viewport = True
+            hidden.append(obj)
+        Log.debug(f"isolated evaluation: kept {len(keep)}, disabled {len(hidden)}")
+    try:
+        yield hidden
+    finally:
+        for obj in hidden:
+            obj.hide_viewport = False
+
+
+@contextmanager
+def use_action(armature: bpy.types.Object, action: bpy.types.Action | None):
+    """Evaluate the armature with only `action`: assign it and disable the NLA, both restored on exit.
+    `None` keeps the current setup."""
+    if action is None:
+        yield
+        return
+    ad = armature.animation_data or armature.animation_data_create()
+    if ad.use_tweak_mode:
+        raise ValueError("Exit the NLA tweak mode to convert several actions")
+    old_action, use_nla = ad.action, ad.use_nla
+    ad.action, ad.use_nla = action, False
+    try:
+        yield
+    finally:
+        ad.action, ad.use_nla = old_action, use_nla
+
+
+def select_actions(
+    armature: bpy.types.Object,
+    bone_names: list[str],
+    source: Literal["ALL", "NLA"] = "ALL",
+    pattern="*",
+):
+    """Names of the actions to convert: every action of the file keying one of the bones,
+    or the actions of the armature's NLA strips, filtered by a `fnmatch` pattern"""
+    if source == "NLA":
+        ad = armature.animation_data
+        candidates = [
+            strip.action
+            for track in (ad.nla_tracks if ad else ())
+            for strip in track.strips
+            if strip.action
+        ]
+    else:
+        bones = set(bone_names)
+        candidates = [
+            a for a in bpy.data.actions if bones & FCurveIndex(a).bones.keys()
+        ]
+    names = [a.name for a in candidates if fnmatch.fnmatchcase(a.name, pattern)]
+    return list(dict.fromkeys(names))
+
+
 def get_frame_range(armature_name: str):
     """Get the frame range of the current action of the armature"""
     armature = bpy.data.objects.get(armature_name)
@@ -240,6 +1614,40 @@ def get_frame_range(armature_name: str):
     return frame_start, frame_end
 
 
+def resolve_takes(
+    armature_name: str,
+    actions: list[str] | None,
+    frame_start: int | None,
+    frame_end: int | None,
+):
+    """(action, frame_start, frame_end) to bake, the range defaults to each action's own"""
+    if actions is None:
+        if frame_start is not None and frame_end is not None:
+            return [(None, frame_start, frame_end)]
+        ranges = [(None, *get_frame_range(armature_name))]
+    else:
+        missing = [name for name in actions if name not in bpy.data.actions]
+        if missing:
+            raise ValueError(f"Actions not found: {missing}")
+        ranges = [
+            (action, int(action.frame_range[0]), int(action.frame_range[1]))
+            for action in (bpy.data.actions[name] for name in actions)
+        ]
+    return [
+        (
+            action,
+            start if frame_start is None else frame_start,
+            end if frame_end is None else frame_end,
+        )
+        for action, start, end in ranges
+    ]
+
+
+def scene_fps():
+    render = bpy.context.scene.render
+    return render.fps / render.fps_base
+
+
 def gen_fk_to_ik(
     armature_name: str,
     bone_names: list[str],
@@ -247,85 +1655,264 @@ def gen_fk_to_ik(
     frame_end: int | None = None,
     mode: Literal["append", "replace"] = "append",
     no_scale=False,
+    isolate=True,
+    decimate: tuple[float, float] | None = None,
+    shards=1,
+    actions: list[str] | None = None,
+    export: str | None = None,
+    incremental=False,
+    step=1.0,
+    fps: float | None = None,
+    window=0,
+    dst_armature: str | None = None,
+    dst_bone_names: list[str] | None = None,
 ):
-    if frame_start is None or frame_end is None:
-        start, end = get_frame_range(armature_name)
-        frame_start = start if frame_start is None else frame_start
-        frame_end = end if frame_end is None else frame_end
-    dup_bone_names = duplicate_bones(armature_name, bone_names)
-    add_constraints(armature_name, dup_bone_names, bone_names, no_scale=no_scale)
-    yield from bake_animation_to_keyframes(
-        armature_name,
-        dup_bone_names,
-        frame_start,
-        frame_end,
-        clear_parents=(mode == "append"),
-    )
-    if mode == "replace":
-        clear_bone_parents(armature_name, bone_names)
-        add_constraints(armature_name, bone_names, dup_bone_names, no_scale=no_scale)
-        yield from bake_animation_to_keyframes(
-            armature_name, bone_names, frame_start, frame_end
-        )
-        cleanup(armature_name, dup_bone_names)
+    """Bake the bones' FK motion to unparented keys, yield while baking.
+    `decimate` is an optional (distance, angle) tolerance for the post-bake key reduction,
+    `shards` the number of background processes `replace` may sample the scene with.
+    `actions` are converted one after another in the same session, reusing the temporary
+    bones and constraints, instead of the current action.
+    `export` is an optional transforms container path the baked bones are also written to,
+    see `export_path` for several actions.
+    `incremental` makes `append` only rebake the frames whose source keys changed since the last run.
+    `step` resamples the bake to one key every `step` scene frames, fractions are evaluated as
+    subframes, or set from a target `fps`. Only the output sample times are evaluated.
+    `window` bounds memory on long takes: at most that many samples are held and keyed at a time,
+    each window is keyed into the action as soon as it's sampled.
+    `dst_armature` retargets instead: the bones are baked straight onto `dst_bone_names` of that
+    armature, paired in order, see `bake_retarget`. `mode` doesn't apply then.
+    Stage timings and counters of the run are left in `Profile.last`.
+    """
+    if fps:
+        step = scene_fps() / fps
+    Log.debug(f"sampling every {step:g} frames")
+    with Profile(
+        armature=armature_name,
+        mode=mode,
+        step=step,
+        window=window,
+        blender=bpy.app.version_string,
+    ):
+        takes = resolve_takes(armature_name, actions, frame_start, frame_end)
+        profile_count("takes", len(takes))
+        profile_count("bones", len(bone_names))
+        with (
+            ArmatureSession(armature_name) as session,
+            isolate_evaluation(session.armature, enabled=isolate),
+        ):
+            export_armature, export_takes = session.armature, takes
+            if dst_armature:
+                dst = bpy.data.objects.get(dst_armature)
+                if not (dst and isinstance(dst.data, bpy.types.Armature)):
+                    raise ValueError(f"Armature '{dst_armature}' not found.")
+                targets = yield from bake_retarget(
+                    session,
+                    bone_names,
+                    dst,
+                    dst_bone_names or bone_names,
+                    takes,
+                    no_scale=no_scale,
+                    shards=shards,
+                    decimate=decimate,
+                    step=step,
+                    window=window,
+                )
+                export_armature, baked_bones = dst, dst_bone_names or bone_names
+                export_takes = [(a, s, e) for a, (_, s, e) in zip(targets, takes)]
+            elif mode == "replace":
+                yield from bake_direct(
+                    session,
+                    bone_names,
+                    takes,
+                    no_scale=no_scale,
+                    shards=shards,
+                    decimate=decimate,
+                    step=step,
+                    window=window,
+                )
+                baked_bones = bone_names
+            else:
+                baked_bones = yield from bake_append(
+                    session,
+                    bone_names,
+                    takes,
+                    no_scale=no_scale,
+                    decimate=decimate,
+                    incremental=incremental,
+                    step=step,
+                    window=window,
+                )
+            if export:
+                for action, start, end in export_takes:
+                    with use_action(export_armature, action), profile_span("export"):
+                        name = ensure_action(export_armature).name
+                        path = export_path(export, name, several=len(takes) > 1)
+                        export_transforms(
+                            export_armature, baked_bones, start, end, path, step
+                        )
 
 
 @copy_args(gen_fk_to_ik)  # type: ignore
 def fk_to_ik(*args, **kwargs):
-    gen = gen_fk_to_ik(*args, **kwargs)
+    drain(gen_fk_to_ik(*args, **kwargs))
+
+
+def drain(gen: Generator[Any, Any, _TV]) -> _TV:
+    """Run a generator to its end, return its return value"""
     while True:
         try:
             next(gen)
-        except StopIteration:
-            break
+        except StopIteration as e:
+            return e.value
 
 
-class FKtoIKOperator(bpy.types.Operator):
-    bl_idname = "object.fk_to_ik"
-    bl_label = "Convert"
-    bl_description = "Convert bones from FK to IK"
-    bl_options = {"REGISTER", "UNDO"}
+class ModalBake:
+    """Run `gen_fk_to_ik` from a timer, baking as many frames as fit in the tick budget between redraws.
+    Esc cancels: the generator is closed, which puts back the previous keys of every take and
+    removes the temporary bones. Parents and constraints are only cleared once all takes are baked.
+    """
+
+    _gen = None
+    _timer = None
 
     @classmethod
     def poll(cls, context):
         props = Props(context)
         return (
-            props.src_armature is not None
+            not GEN
+            and props.src_armature is not None
             and props.bone_list
             and (props.frame_start != props.frame_end)
         )
 
-    def execute(self, context):
+    def kwargs(self, context) -> dict:
+        """`gen_fk_to_ik` arguments shared by the bake operators, from the panel settings"""
         props = Props(context)
-        armature_name = props.src_armature.name
-        bone_names = [item.bone for item in props.bone_list]
-        fk_to_ik(armature_name, bone_names, mode="replace")
+        return dict(
+            armature_name=props.src_armature.name,
+            bone_names=[item.src_bone for item in props.bone_list],
+            isolate=props.is_isolated,
+            decimate=props.decimate(),
+            actions=props.actions(),
+            step=props.frame_step,
+            fps=props.target_fps or None,
+            window=props.bake_window,
+        )
+
+    def execute(self, context):
+        try:
+            fk_to_ik(**self.kwargs(context))
+        except ValueError as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
         return {"FINISHED"}
 
+    def invoke(self, context, event):
+        self._gen = gen_fk_to_ik(**self.kwargs(context))
+        GEN.append(self._gen)
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.01, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context, event):
+        if event.type == "ESC":
+            self.stop(context, close=True)
+            self.report({"WARNING"}, "FK to IK cancelled, previous keys restored")
+            return {"CANCELLED"}
+        if event.type != "TIMER":
+            return {"RUNNING_MODAL"}
+
+        deadline = time.perf_counter() + Props(context).tick_budget
+        # the time between ticks belongs to the UI, not to the bake stages
+        if Profile.current:
+            Profile.current.resume()
+        try:
+            while time.perf_counter() < deadline:
+                next(self._gen)  # type: ignore
+            if Profile.current:
+                Profile.current.pause()
+        except StopIteration:
+            self.stop(context)
+            return {"FINISHED"}
+        except Exception as e:
+            self.stop(context)
+            Log.error("bake failed", e)
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
+        if Progress.current:
+            context.workspace.status_text_set(
+                f"FK to IK: {Progress.current}, Esc to cancel"
+            )
+        return {"RUNNING_MODAL"}
+
+    def stop(self, context, close=False):
+        if close:
+            self._gen.close()  # type: ignore
+        if self._gen in GEN:
+            GEN.remove(self._gen)
+        context.window_manager.event_timer_remove(self._timer)
+        context.workspace.status_text_set(None)
+
 
-class FK_append_to_IK_Operator(bpy.types.Operator):
+class FKtoIKOperator(ModalBake, bpy.types.Operator):
+    bl_idname = "object.fk_to_ik"
+    bl_label = "Convert"
+    bl_description = "Convert bones from FK to IK"
+    bl_options = {"REGISTER"}
+
+    def kwargs(self, context):
+        return dict(
+            super().kwargs(context), mode="replace", shards=Props(context).shards
+        )
+
+
+class FK_append_to_IK_Operator(ModalBake, bpy.types.Operator):
     bl_idname = "object.fk_append_to_ik"
     bl_label = "Append"
     bl_description = "Convert FK then append the IK bones layer to armature, keeping the original bones"
-    bl_options = {"REGISTER", "UNDO"}
+    bl_options = {"REGISTER"}
+
+    def kwargs(self, context):
+        props = Props(context)
+        return dict(
+            super().kwargs(context),
+            mode="append",
+            no_scale=not props.is_copy_scale,
+            incremental=props.is_incremental,
+        )
+
+
+class FK_retarget_Operator(ModalBake, bpy.types.Operator):
+    bl_idname = "object.fk_to_ik_retarget"
+    bl_label = "Retarget"
+    bl_description = "Bake the source bones straight onto their destination bones of the target armature, the source is left untouched. Decimation only reduces destination bones without a parent"
+    bl_options = {"REGISTER"}
 
     @classmethod
     def poll(cls, context):
         props = Props(context)
         return (
-            props.src_armature is not None
-            and props.bone_list
-            and (props.frame_start != props.frame_end)
+            super().poll(context)
+            and props.dst_armature is not None
+            and props.dst_armature != props.src_armature
         )
 
-    def execute(self, context):
+    def kwargs(self, context):
         props = Props(context)
-        armature_name = props.src_armature.name
-        bone_names = [item.bone for item in props.bone_list]
-        fk_to_ik(
-            armature_name, bone_names, mode="append", no_scale=not props.is_copy_scale
+        pairs = [
+            (item.src_bone, item.dst_bone)
+            for item in props.bone_list
+            if item.src_bone and item.dst_bone
+        ]
+        return dict(
+            super().kwargs(context),
+            bone_names=[src for src, _ in pairs],
+            dst_armature=props.dst_armature.name,
+            dst_bone_names=[dst for _, dst in pairs],
+            no_scale=not props.is_copy_scale,
+            shards=props.shards,
         )
-        return {"FINISHED"}
 
 
 class FKtoIKPanel(bpy.types.Panel):
@@ -344,10 +1931,10 @@ class FKtoIKPanel(bpy.types.Panel):
         col = layout.column(align=True)
         row = col.row(align=True)
         row.prop(props, "mapping_preset", icon="GROUP_BONE", text="")
+        if props.mapping_preset != "new":
+            row.operator("object.bone_list_remove_mapping", icon="TRASH", text="")
         row.operator("wm.open_dir_mapping", icon="FILE_FOLDER", text="")
 
-        if props.mapping_preset != "new":
-            return
         row = col.row(align=True)
         _row = row.row(align=True)
         _row.prop(
@@ -371,13 +1958,13 @@ class FKtoIKPanel(bpy.types.Panel):
         row = col.column(align=True)
         if not props.src_armature:
             return
-        # row.prop(
-        #     props,
-        #     "dst_armature",
-        #     text="",
-        #     placeholder="Target",
-        #     icon="ARMATURE_DATA",
-        # )
+        row.prop(
+            props,
+            "dst_armature",
+            text="",
+            placeholder="Target",
+            icon="ARMATURE_DATA",
+        )
 
         row = layout.row()
         row.template_list(
@@ -387,14 +1974,63 @@ class FKtoIKPanel(bpy.types.Panel):
         col.operator("object.bone_list_get_current", icon="FILE_REFRESH", text="")
         col.operator("object.bone_list_add", icon="ADD", text="")
         col.operator("object.bone_list_remove", icon="REMOVE", text="")
+        col.operator("object.bone_list_auto_match", icon="LINKED", text="")
         col.operator("object.bone_list_export", icon="EXPORT", text="")
 
-        layout.prop(props, "is_copy_scale", text="Copy Scale")
+        row = layout.row(align=True)
+        row.prop(props, "is_copy_scale", text="Copy Scale")
+        row.prop(props, "is_isolated", text="Isolate")
+        row = layout.row(align=True)
+        row.prop(props, "tick_budget")
+        row.prop(props, "shards")
+        row = layout.row(align=True)
+        row.prop(props, "frame_step")
+        row.prop(props, "target_fps")
+        layout.prop(props, "bake_window")
+        row = layout.row(align=True)
+        row.prop(props, "action_source", text="")
+        if props.action_source != "CURRENT":
+            row.prop(props, "action_filter", text="", icon="FILTER")
+        col = layout.column(align=True)
+        col.prop(props, "is_decimate", text="Decimate")
+        if props.is_decimate:
+            col.prop(props, "decimate_distance", text="Distance")
+            col.prop(props, "decimate_angle", text="Angle")
         col = layout.column(align=True)
         col.operator("object.fk_to_ik", icon="BONE_DATA")
         row = col.row(align=True)
         row.operator("object.fk_append_to_ik", icon="GROUP_BONE")
         row.prop(props, "bone_layer_fallback", icon="ADD", text="")
+        row.prop(props, "is_incremental", icon="FILE_REFRESH", text="")
+        if props.dst_armature and props.dst_armature != props.src_armature:
+            col.operator("object.fk_to_ik_retarget", icon="ARMATURE_DATA")
+        row = col.row(align=True)
+        row.operator("object.fk_to_ik_export_transforms", icon="EXPORT", text="Export")
+        row.operator("object.fk_to_ik_import_transforms", icon="IMPORT", text="Import")
+
+        profile = Profile.last
+        if profile:
+            box = layout.box()
+            row = box.row(align=True)
+            row.prop(
+                props,
+                "show_profile",
+                text=f"Last run {profile.seconds:.2f}s",
+                icon="TRIA_DOWN" if props.show_profile else "TRIA_RIGHT",
+                emboss=False,
+            )
+            row.operator("object.fk_to_ik_export_profile", icon="EXPORT", text="")
+            if props.show_profile:
+                col = box.column(align=True)
+                for name, (calls, seconds) in profile.stages().items():
+                    col.label(text=f"{name}: {seconds:.3f}s ({calls}x)")
+                for name, value in profile.counters.items():
+                    col.label(text=f"{name}: {value}")
+                frame = profile.report(spans=False)["latency"].get("frame")
+                if frame and frame["count"]:
+                    col.label(
+                        text=f"frame: p50 {frame['p50_ms']:.2f}ms, p99 {frame['p99_ms']:.2f}ms, max {frame['max_ms']:.2f}ms"
+                    )
 
         row = layout.row(align=True)
         sx, sy = get_scale()
@@ -403,10 +2039,237 @@ class FKtoIKPanel(bpy.types.Panel):
         )
 
 
+class BoneIndex:
+    """Name lookups over an armature's bones for the UI, built once per armature and cached until
+    its bones change (see `on_depsgraph_update`), so redraws never scan `Armature.bones`.
+    Prefix, substring, bone collection and subtree queries return sets of bone names."""
+
+    cache: dict[int, "BoneIndex"] = {}
+    builds = 0
+
+    def __init__(self, data: bpy.types.Armature):
+        bones = data.bones
+        self.names = [b.name for b in bones]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.parents = np.array(
+            [self.index[b.parent.name] if b.parent else -1 for b in bones], dtype=int
+        )
+        self.sorted = sorted((name.lower(), name) for name in self.names)
+        self.keys = [key for key, _ in self.sorted]
+        # one string to search substrings in at C speed, line starts map matches back to bones
+        self.text = "\n".join(name.lower() for name in self.names)
+        self.starts = np.cumsum([0] + [len(name) + 1 for name in self.names[:-1]])
+        self.collections = {
+            c.name: {b.name for b in c.bones} for c in data.collections_all
+        }
+        # preorder, so that every subtree is the contiguous slice `preorder[i:end[i]]`
+        children: dict[str, list[str]] = {}
+        for bone in bones:
+            children.setdefault(bone.parent.name if bone.parent else "", []).append(
+                bone.name
+            )
+        self.preorder: list[str] = []
+        self.position: dict[str, int] = {}
+        self.end = [0] * len(self.names)
+        stack = [(name, False) for name in reversed(children.get("", []))]
+        while stack:
+            name, done = stack.pop()
+            if done:
+                self.end[self.position[name]] = len(self.preorder)
+                continue
+            self.position[name] = len(self.preorder)
+            self.preorder.append(name)
+            stack.append((name, True))
+            stack.extend((c, False) for c in reversed(children.get(name, [])))
+        BoneIndex.builds += 1
+        self.serial = BoneIndex.builds
+
+    @classmethod
+    def of(cls, data: bpy.types.Armature) -> "BoneIndex":
+        key = data.as_pointer()
+        index = cls.cache.get(key)
+        if index is None or len(index.names) != len(data.bones):
+            index = cls.cache[key] = cls(data)
+        return index
+
+    @classmethod
+    def invalidate(cls, data: bpy.types.Armature | None = None):
+        if data is None:
+            cls.cache.clear()
+        else:
+            cls.cache.pop(data.as_pointer(), None)
+
+    def __contains__(self, name: str):
+        return name in self.index
+
+    def prefix(self, text: str):
+        text = text.lower()
+        lo = bisect.bisect_left(self.keys, text)
+        hi = bisect.bisect_left(self.keys, text + "\uffff", lo)
+        return {name for _, name in self.sorted[lo:hi]}
+
+    def substring(self, text: str):
+        text = text.lower()
+        found = set()
+        at = self.text.find(text)
+        while at >= 0:
+            i = int(np.searchsorted(self.starts, at, side="right")) - 1
+            found.add(self.names[i])
+            # continue on the next bone
+            at = self.text.find(text, self.starts[i] + len(self.names[i]) + 1)
+        return found
+
+    def collection(self, name: str):
+        return self.collections.get(name, set())
+
+    def subtree(self, name: str):
+        """The bone and all of its descendants"""
+        i = self.position.get(name)
+        return set() if i is None else set(self.preorder[i : self.end[i]])
+
+    def match(self, mode: str, text: str):
+        return {
+            "PREFIX": self.prefix,
+            "SUBSTRING": self.substring,
+            "COLLECTION": self.collection,
+            "SUBTREE": self.subtree,
+        }[mode](text)
+
+
+@bpy.app.handlers.persistent
+def on_depsgraph_update(scene, depsgraph: bpy.types.Depsgraph):
+    """Drop the `BoneIndex` and `RigDescriptor` of armatures whose bones were changed.
+    Pose and selection updates don't touch the bones and are skipped, leaving edit mode updates
+    the geometry. The add-on's own edits also invalidate in `ArmatureSession.set_mode`.
+    """
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Armature) and update.is_updated_geometry:
+            BoneIndex.invalidate(update.id.original)  # type: ignore
+            RigDescriptor.invalidate(update.id.original)  # type: ignore
+
+
+@bpy.app.handlers.persistent
+def on_load_pre(*args):
+    """Close the running bakes while their file is still loaded: the modal handlers are dropped
+    with it, and a generator left in `GEN` would keep both operators disabled"""
+    while GEN:
+        gen = GEN.pop()
+        try:
+            gen.close()
+        except Exception as e:
+            Log.error("closing bake failed", e)
+
+
+@bpy.app.handlers.persistent
+def on_load(scene=None):
+    # pointers of the previous file may be reused
+    BoneIndex.invalidate()
+    RigDescriptor.invalidate()
+    BoneListItem.version += 1
+
+
+class MappingStore:
+    """On-disk library of named bone mappings, a `<name>.json` file of {"pairs": [[src, dst], ...]}
+    per preset. Listing only stats the directory, a preset is read on first use and kept in
+    memory until its file changes."""
+
+    def __init__(self, directory: str | None = None):
+        self._directory = directory
+        self._names: tuple[int, list[str]] | None = None
+        self._pairs: dict[str, tuple[int, list[tuple[str, str]]]] = {}
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            self._directory = bpy.utils.user_resource(
+                "CONFIG", path=os.path.join("fktoik", "mappings"), create=True
+            )
+        return self._directory
+
+    def path(self, name: str):
+        return os.path.join(self.directory, name + ".json")
+
+    def names(self):
+        mtime = os.stat(self.directory).st_mtime_ns
+        if not self._names or self._names[0] != mtime:
+            names = sorted(
+                entry.name[: -len(".json")]
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(".json") and entry.is_file()
+            )
+            self._names = (mtime, names)
+        return self._names[1]
+
+    def load(self, name: str):
+        path = self.path(name)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._pairs.get(name)
+        if not cached or cached[0] != mtime:
+            with open(path) as f:
+                pairs = [(src, dst) for src, dst in json.load(f)["pairs"]]
+            cached = self._pairs[name] = (mtime, pairs)
+        return cached[1]
+
+    def save(self, name: str, pairs: list[tuple[str, str]]):
+        """Write the preset, return its name made safe for a file name"""
+        name = bpy.path.clean_name(name)
+        with open(self.path(name), "w") as f:
+            json.dump(dict(pairs=pairs), f, indent=1)
+        return name
+
+    def remove(self, name: str):
+        os.remove(self.path(name))
+        self._pairs.pop(name, None)
+
+
+MAPPINGS = MappingStore()
+# dynamic enum items have to outlive the callback, see `bpy.props.EnumProperty`
+_mapping_items = []
+
+
+def mapping_preset_items(self, context):
+    global _mapping_items
+    _mapping_items = [("new", "new preset", "New preset")] + [
+        (name, name, f"Bone mapping '{name}'") for name in MAPPINGS.names()
+    ]
+    return _mapping_items
+
+
+def mapping_preset_changed(self, context):
+    """Fill the bone list with the selected preset"""
+    if self.mapping_preset == "new":
+        return
+    try:
+        pairs = MAPPINGS.load(self.mapping_preset)
+    except (OSError, ValueError, KeyError) as e:
+        Log.error(f"Can't load mapping '{self.mapping_preset}'", e)
+        return
+    self.bone_list.clear()
+    bone_list_changed(self, context)
+    for src, dst in pairs:
+        item = self.bone_list.add()
+        item.src_bone, item.dst_bone = src, dst
+    self.bone_list_index = 0
+
+
+def bone_list_changed(self, context):
+    BoneListItem.version += 1
+
+
+@bpy.app.handlers.persistent
+def on_undo_redo(scene=None, *args):
+    # undo and redo change the bone list without its update callbacks
+    BoneListItem.version += 1
+
+
 class BoneListItem(bpy.types.PropertyGroup):
     """Group of properties representing an item in the list"""
 
-    src_bone: bpy.props.StringProperty(name="Source FK Bone")  # type: ignore
+    # bumped on every source bone edit, list change, undo, redo and file load,
+    # the list's filter results are cached per version
+    version = 0
+
+    src_bone: bpy.props.StringProperty(name="Source FK Bone", update=bone_list_changed)  # type: ignore
     dst_bone: bpy.props.StringProperty(name="Destination IK Bone")  # type: ignore
 
     @staticmethod
@@ -421,10 +2284,24 @@ class BoneListItem(bpy.types.PropertyGroup):
         for i in reversed(items_to_remove):
             if i < len(props.bone_list):
                 props.bone_list.remove(i)
+        bone_list_changed(props, None)
+
+
+def split_factor(region_width: int):
+    """Width of the source column of rows whose destination bone is new"""
+    return min(0.95, max(0.05, 1 - ((region_width - 85) / 1700)))
 
 
 class BONE_UL_items(bpy.types.UIList):
-    """Custom UIList for displaying bones"""
+    """Custom UIList for displaying bones.
+    Only the active row gets search widgets, other rows are plain fields, and the filter result
+    is cached until the list's source bones, the armature's bones or the filter change.
+    """
+
+    filter_mode: bpy.props.EnumProperty(name="Filter", items=[("SUBSTRING", "Contains", "Source bones containing the text"), ("PREFIX", "Starts With", "Source bones starting with the text"), ("COLLECTION", "Collection", "Source bones in the bone collection"), ("SUBTREE", "Children Of", "Source bones in the hierarchy below this bone, itself included")], default="SUBSTRING")  # type: ignore
+
+    # (key, (flags, order)) of the last `filter_items`
+    _filtered: tuple[tuple, tuple[list[int], list[int]]] | None = None
 
     def draw_item(
         self,
@@ -443,51 +2320,77 @@ class BONE_UL_items(bpy.types.UIList):
         ):
             return
         src = props.src_armature
+        dst = props.dst_armature or src
         if self.layout_type in {"DEFAULT", "COMPACT"}:
-            is_dstBone_in_srcArmature = item.dst_bone in src.data.bones
+            is_dstBone_in_srcArmature = item.dst_bone in BoneIndex.of(dst.data)
             split = layout.split(
                 factor=(
                     0.5
                     if is_dstBone_in_srcArmature
-                    else min(
-                        0.95, max(0.05, 1 - ((bpy.context.region.width - 85) / 1700))
-                    )
+                    else split_factor(context.region.width)
                 ),
                 align=True,
             )
+            dst_icon = "RIGHTARROW" if is_dstBone_in_srcArmature else "ADD"
+            if index != getattr(active_data, active_propname):
+                split.prop(item, "src_bone", text="", emboss=False)
+                split.prop(item, "dst_bone", text="", emboss=False, icon=dst_icon)
+                return
             split.prop_search(item, "src_bone", src.data, "bones", text="")
             split.prop_search(
                 item,
                 "dst_bone",
-                src.data,
+                dst.data,
                 "bones",
                 text="",
-                icon="RIGHTARROW" if is_dstBone_in_srcArmature else "ADD",
+                icon=dst_icon,
                 results_are_suggestions=True,
             )
-            # TODO: use dst.data when NOT dst_armature == src_armature
         elif self.layout_type in {"GRID"}:
             ...
 
+    def draw_filter(self, context, layout):
+        row = layout.row(align=True)
+        row.prop(self, "filter_mode", text="")
+        row.prop(self, "filter_name", text="")
+        row.prop(self, "use_filter_sort_alpha", text="", icon="SORTALPHA")
+
     def filter_items(self, context, data, propname):
         bone_list = getattr(data, propname, [])
-        flt_flags = []
+        armature = Props(context).src_armature
+        bone_index = (
+            BoneIndex.of(armature.data)
+            if armature and isinstance(armature.data, bpy.types.Armature)
+            else None
+        )
+        key = (
+            data.as_pointer(),
+            propname,
+            BoneListItem.version,
+            bone_index.serial if bone_index else 0,
+            self.filter_mode,
+            self.filter_name,
+            self.use_filter_sort_alpha,
+        )
+        cached = type(self)._filtered
+        if cached and cached[0] == key:
+            return cached[1]
+
+        names = [item.src_bone for item in bone_list]
+        flt_flags = [self.bitflag_filter_item] * len(names)
+        if self.filter_name and bone_index:
+            matched = bone_index.match(self.filter_mode, self.filter_name)
+            flt_flags = [
+                self.bitflag_filter_item if name in matched else 0 for name in names
+            ]
         flt_neworder = []
+        if self.use_filter_sort_alpha:
+            flt_neworder = [0] * len(names)
+            order = sorted(range(len(names)), key=lambda i: names[i].lower())
+            for position, i in enumerate(order):
+                flt_neworder[i] = position
 
-        # 如果有文本过滤器，则应用过滤
-        if self.filter_name:
-            flt_flags = bpy.types.UI_UL_list.filter_items_by_name(
-                self.filter_name,
-                self.bitflag_filter_item,
-                bone_list,
-                "src_bone",
-                reverse=False,
-            )
-
-        # 如果没有过滤器标志，则初始化为所有项都可见
-        if not flt_flags:
-            flt_flags = [self.bitflag_filter_item] * len(bone_list)
-
+        type(self)._filtered = (key, (flt_flags, flt_neworder))
         return flt_flags, flt_neworder
 
 
@@ -504,18 +2407,17 @@ class OBJECT_OT_BoneListGetCurrent(bpy.types.Operator):
         if not (armature and isinstance(armature.data, bpy.types.Armature)):
             return {"CANCELLED"}
         props.bone_list.clear()
+        bone_list_changed(props, context)
 
         bones = []
         if context.mode == "EDIT_ARMATURE":
             bones = [b for b in armature.data.edit_bones if b.select]
         elif context.mode == "POSE":
             bones = [b for b in armature.pose.bones if b.bone.select]
-        if not bones:
-            bones = armature.data.bones
-
-        for bone in bones:
+        names = [b.name for b in bones] if bones else BoneIndex.of(armature.data).names
+        for name in names:
             item = props.bone_list.add()
-            item.src_bone = bone.name
+            item.src_bone = name
         props.bone_list_index = 0
         return {"FINISHED"}
 
@@ -529,6 +2431,7 @@ class OBJECT_OT_BoneListAdd(bpy.types.Operator):
     def execute(self, context):
         props = Props(context)
         props.bone_list.add()
+        bone_list_changed(props, context)
         return {"FINISHED"}
 
 
@@ -544,60 +2447,232 @@ class OBJECT_OT_BoneListRemove(bpy.types.Operator):
         bone_list = props.bone_list
         index = props.bone_list_index
         bone_list.remove(index)
+        bone_list_changed(props, context)
         props.bone_list_index = max(0, index - 1)
         return {"FINISHED"}
 
 
 class OBJECT_OT_BoneListExport(bpy.types.Operator):
-    """Export the selected bones to a preset"""
+    """Save the bone list as a mapping preset, and its source bones to //bone_list.txt for `--bones-file`"""
 
     bl_idname = "object.bone_list_export"
     bl_label = "Export"
 
+    name: bpy.props.StringProperty(name="Preset Name")  # type: ignore
+
+    @classmethod
+    def poll(cls, context):
+        return bool(Props(context).bone_list)
+
+    def invoke(self, context, event):
+        props = Props(context)
+        if props.mapping_preset != "new":
+            self.name = props.mapping_preset
+        elif props.src_armature:
+            self.name = props.src_armature.name
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        props = Props(context)
+        pairs = [(item.src_bone, item.dst_bone) for item in props.bone_list]
+        name = MAPPINGS.save(self.name or "mapping", pairs)
+        props.mapping_preset = name
+
+        if bpy.data.filepath:
+            file_path = bpy.path.abspath("//bone_list.txt")
+            with open(file_path, "w") as f:
+                for src, _ in pairs:
+                    f.write(f"{src}\n")
+        self.report({"INFO"}, f"Bone mapping saved as '{name}'")
+        return {"FINISHED"}
+
+
+class OBJECT_OT_BoneListRemoveMapping(bpy.types.Operator):
+    """Delete the selected mapping preset from disk"""
+
+    bl_idname = "object.bone_list_remove_mapping"
+    bl_label = "Delete Mapping"
+
+    @classmethod
+    def poll(cls, context):
+        return Props(context).mapping_preset != "new"
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_confirm(self, event)
+
+    def execute(self, context):
+        props = Props(context)
+        MAPPINGS.remove(props.mapping_preset)
+        props.mapping_preset = "new"
+        return {"FINISHED"}
+
+
+class OBJECT_OT_BoneListAutoMatch(bpy.types.Operator):
+    """Pair the listed source bones (all bones if the list is empty) with destination bones of the
+    target armature by name and hierarchy"""
+
+    bl_idname = "object.bone_list_auto_match"
+    bl_label = "Auto Match"
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        return Props(context).src_armature is not None
+
+    def execute(self, context):
+        props = Props(context)
+        src = BoneIndex.of(props.src_armature.data)
+        dst = BoneIndex.of((props.dst_armature or props.src_armature).data)
+        if not props.bone_list:
+            for name in src.names:
+                props.bone_list.add().src_bone = name
+        mapping = match_bones(src.names, src.parents, dst.names, dst.parents)
+        matched = 0
+        for item in props.bone_list:
+            if item.src_bone in mapping:
+                item.dst_bone = mapping[item.src_bone]
+                matched += 1
+        self.report({"INFO"}, f"Matched {matched} of {len(props.bone_list)} bones")
+        return {"FINISHED"}
+
+
+class WM_OT_OpenDirMapping(bpy.types.Operator):
+    """Open the folder of the mapping presets"""
+
+    bl_idname = "wm.open_dir_mapping"
+    bl_label = "Open Mapping Folder"
+
+    def execute(self, context):
+        bpy.ops.wm.path_open(filepath=MAPPINGS.directory)
+        return {"FINISHED"}
+
+
+class OBJECT_OT_TransformsExport(bpy.types.Operator, ExportHelper):
+    """Export the keyed transforms of the listed bones to a compact float32 file"""
+
+    bl_idname = "object.fk_to_ik_export_transforms"
+    bl_label = "Export Transforms"
+    filename_ext = ".fkik"
+    filter_glob: bpy.props.StringProperty(default="*.fkik", options={"HIDDEN"})  # type: ignore
+
+    @classmethod
+    def poll(cls, context):
+        props = Props(context)
+        return props.src_armature is not None and props.bone_list
+
     def execute(self, context):
         props = Props(context)
         armature = props.src_armature
-        if not (armature and isinstance(armature.data, bpy.types.Armature)):
+        try:
+            frame_start, frame_end = get_frame_range(armature.name)
+        except ValueError as e:
+            self.report({"ERROR"}, str(e))
             return {"CANCELLED"}
+        bone_names = [item.src_bone for item in props.bone_list]
+        step = scene_fps() / props.target_fps if props.target_fps else props.frame_step
+        export_transforms(
+            armature, bone_names, frame_start, frame_end, self.filepath, step
+        )
+        self.report({"INFO"}, f"Transforms exported to {self.filepath}")
+        return {"FINISHED"}
 
-        # Get the selected bones
-        selected_bones = [b for b in armature.data.bones if b.select]
-        if not selected_bones:
-            self.report({"WARNING"}, "No bones selected")
-            return {"CANCELLED"}
 
-        # Export the bone list to a file
-        file_path = bpy.path.abspath("//bone_list.txt")
-        with open(file_path, "w") as f:
-            for bone in selected_bones:
-                f.write(f"{bone.name}\n")
+class OBJECT_OT_ProfileExport(bpy.types.Operator, ExportHelper):
+    """Export the timings and counters of the last conversion as JSON"""
 
-        self.report({"INFO"}, f"Bone list exported to {file_path}")
+    bl_idname = "object.fk_to_ik_export_profile"
+    bl_label = "Export Profile"
+    filename_ext = ".json"
+    filter_glob: bpy.props.StringProperty(default="*.json", options={"HIDDEN"})  # type: ignore
+
+    @classmethod
+    def poll(cls, context):
+        return Profile.last is not None
+
+    def execute(self, context):
+        Profile.last.dump(self.filepath)  # type: ignore
+        self.report({"INFO"}, f"Profile exported to {self.filepath}")
+        return {"FINISHED"}
+
+
+class OBJECT_OT_TransformsImport(bpy.types.Operator, ImportHelper):
+    """Import a transforms file as a new action of the armature"""
+
+    bl_idname = "object.fk_to_ik_import_transforms"
+    bl_label = "Import Transforms"
+    bl_options = {"REGISTER", "UNDO"}
+    filename_ext = ".fkik"
+    filter_glob: bpy.props.StringProperty(default="*.fkik", options={"HIDDEN"})  # type: ignore
+
+    @classmethod
+    def poll(cls, context):
+        return Props(context).src_armature is not None
+
+    def execute(self, context):
+        try:
+            action = import_transforms(Props(context).src_armature, self.filepath)
+        except ValueError as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
+        self.report({"INFO"}, f"Transforms imported as '{action.name}'")
         return {"FINISHED"}
 
 
 class FKtoIK_PropsGroup(bpy.types.PropertyGroup):
-    mapping_preset: bpy.props.EnumProperty(name="Mapping Preset", items=[("new", "new preset", "New preset")])  # type: ignore
+    mapping_preset: bpy.props.EnumProperty(name="Mapping Preset", items=mapping_preset_items, update=mapping_preset_changed, description="Fill the bone list from a saved mapping")  # type: ignore
     src_armature: bpy.props.PointerProperty(type=bpy.types.Object, poll=lambda self, obj: obj.type == "ARMATURE")  # type: ignore
-    # dst_armature: bpy.props.PointerProperty(type=bpy.types.Object, poll=lambda self, obj: obj.type == "ARMATURE")  # type: ignore
+    dst_armature: bpy.props.PointerProperty(type=bpy.types.Object, poll=lambda self, obj: obj.type == "ARMATURE", description="Armature of the destination bones, the source armature if empty")  # type: ignore
     is_current_selected: bpy.props.BoolProperty(name="Use Current Selected", default=True, description="Refresh bone list with current selected armature")  # type: ignore
     bone_list: bpy.props.CollectionProperty(type=BoneListItem)  # type: ignore
     bone_list_index: bpy.props.IntProperty()  # type: ignore
     frame_start: bpy.props.IntProperty(name="Frame Start", default=1)  # type: ignore
     frame_end: bpy.props.IntProperty(name="Frame End", default=250)  # type: ignore
     is_copy_scale: bpy.props.BoolProperty(name="Copy Scale", default=True, description="If true, the constraint would be `COPY_TRANSFORMS`, else `COPY_LOCATION`+`COPY_ROTATION`")  # type: ignore
+    is_isolated: bpy.props.BoolProperty(name="Isolate Evaluation", default=True, description="While baking, only evaluate the armature and its constraint/driver targets, other objects are disabled in viewports and restored afterwards")  # type: ignore
+    tick_budget: bpy.props.FloatProperty(name="Tick Budget", default=0.1, min=0.01, max=2.0, subtype="TIME_ABSOLUTE", description="Seconds of baking between two UI redraws, higher is faster but less responsive")  # type: ignore
+    shards: bpy.props.IntProperty(name="Processes", default=1, min=1, max=256, description="Background Blender processes sampling the scene in parallel when Convert can't use forward kinematics, each one bakes a part of the frame range on a copy of the file")  # type: ignore
+    frame_step: bpy.props.FloatProperty(name="Step", default=1.0, min=0.01, soft_max=16, precision=2, description="Bake one key every this many frames, fractions are evaluated as subframes. Only these sample times are evaluated")  # type: ignore
+    target_fps: bpy.props.FloatProperty(name="Target FPS", default=0, min=0, description="Bake at this frame rate instead, e.g. 30 for a 240 fps capture is a step of 8 frames. 0 uses Step")  # type: ignore
+    bake_window: bpy.props.IntProperty(name="Window", default=0, min=0, soft_max=100000, description="Bake long takes this many keys at a time to bound memory, the bones' previous keys are restored if the bake is cancelled. 0 bakes each take at once")  # type: ignore
+    is_decimate: bpy.props.BoolProperty(name="Decimate", default=False, description="After baking, reduce every channel to the fewest Bezier keys within the tolerances")  # type: ignore
+    decimate_distance: bpy.props.FloatProperty(name="Distance Tolerance", default=0.001, min=0, precision=4, subtype="DISTANCE", description="Max location/scale deviation of the decimated curves")  # type: ignore
+    decimate_angle: bpy.props.FloatProperty(name="Angle Tolerance", default=math.radians(0.1), min=0, precision=3, subtype="ANGLE", description="Max rotation deviation of the decimated curves")  # type: ignore
+    action_source: bpy.props.EnumProperty(name="Actions", items=[("CURRENT", "Current Action", "Convert the active action"), ("ALL", "All Actions", "Convert every action keying the listed bones, one after another"), ("NLA", "NLA Strips", "Convert the action of every NLA strip of the armature, one after another")], description="Actions to convert, the temporary bones and constraints are set up once for all of them")  # type: ignore
+    action_filter: bpy.props.StringProperty(name="Action Filter", default="*", description="Only convert the actions whose name matches this wildcard pattern")  # type: ignore
+    show_profile: bpy.props.BoolProperty(name="Profile", default=False, description="Show where the time of the last conversion went")  # type: ignore
+    is_incremental: bpy.props.BoolProperty(name="Incremental", default=False, description="Append reuses the .IK bones of the last run and only rebakes the frames whose source keys changed since, tracked by hashes stored on the action. Changes outside the action, like constraints, need a full bake")  # type: ignore
     bone_layer_fallback: bpy.props.StringProperty(name="Bone Layer Fallback", default="IK")  # type: ignore
 
+    def decimate(self):
+        return (
+            (self.decimate_distance, self.decimate_angle) if self.is_decimate else None
+        )
+
+    def actions(self):
+        if self.action_source == "CURRENT":
+            return None
+        bone_names = [item.src_bone for item in self.bone_list]
+        return select_actions(
+            self.src_armature, bone_names, self.action_source, self.action_filter
+        )
+
 
 CLASS = [
     BoneListItem,
     FKtoIK_PropsGroup,
     FKtoIKOperator,
     FK_append_to_IK_Operator,
+    FK_retarget_Operator,
     OBJECT_OT_BoneListGetCurrent,
     OBJECT_OT_BoneListAdd,
     OBJECT_OT_BoneListRemove,
     OBJECT_OT_BoneListExport,
+    OBJECT_OT_BoneListRemoveMapping,
+    OBJECT_OT_BoneListAutoMatch,
+    WM_OT_OpenDirMapping,
+    OBJECT_OT_TransformsExport,
+    OBJECT_OT_TransformsImport,
+    OBJECT_OT_ProfileExport,
     BONE_UL_items,
 ]
 CLASS_UI = [
@@ -629,12 +2704,22 @@ def register():
     bpy.types.Scene.FKtoIK_props = bpy.props.PointerProperty(type=FKtoIK_PropsGroup)  # type: ignore
     [bpy.utils.register_class(cls) for cls in CLASS_UI]
     bpy.app.handlers.load_post.append(register_msgbus)
+    bpy.app.handlers.load_pre.append(on_load_pre)
+    bpy.app.handlers.load_post.append(on_load)
+    bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update)
+    bpy.app.handlers.undo_post.append(on_undo_redo)
+    bpy.app.handlers.redo_post.append(on_undo_redo)
 
 
 def unregister():
     bpy.msgbus.clear_by_owner(OWNER)
     try:
         bpy.app.handlers.load_post.remove(register_msgbus)
+        bpy.app.handlers.load_pre.remove(on_load_pre)
+        bpy.app.handlers.load_post.remove(on_load)
+        bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update)
+        bpy.app.handlers.undo_post.remove(on_undo_redo)
+        bpy.app.handlers.redo_post.remove(on_undo_redo)
     except Exception as e:
         Log.error("", exc_info=e)
     [bpy.utils.unregister_class(cls) for cls in reversed(CLASS_UI)]
@@ -642,5 +2727,464 @@ def unregister():
     [bpy.utils.unregister_class(cls) for cls in reversed(CLASS)]
 
 
+def load_input(path: str):
+    """Open or import a .blend/FBX/BVH take into the current (background) session"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".blend":
+        if bpy.data.filepath != os.path.abspath(path):
+            bpy.ops.wm.open_mainfile(filepath=path)
+    elif ext == ".fbx":
+        bpy.ops.import_scene.fbx(filepath=path)
+    elif ext == ".bvh":
+        bpy.ops.import_anim.bvh(filepath=path)
+    else:
+        raise ValueError(f"Unsupported input: {path}")
+
+
+def save_output(path: str, armature_name: str):
+    ext = os.path.splitext(path)[1].lower()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if ext == ".blend":
+        bpy.ops.wm.save_as_mainfile(filepath=path)
+        return
+    armature = bpy.data.objects[armature_name]
+    bpy.context.view_layer.objects.active = armature
+    armature.select_set(True)
+    if ext == ".fbx":
+        bpy.ops.export_scene.fbx(filepath=path, use_selection=True, bake_anim=True)
+    elif ext == ".bvh":
+        bpy.ops.export_anim.bvh(filepath=path)
+    else:
+        raise ValueError(f"Unsupported output: {path}")
+
+
+def read_bone_list(path: str):
+    """Bone names from a text file, one per line like `OBJECT_OT_BoneListExport` writes"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def run_job(job: dict):
+    """Convert one take in this Blender process, return its summary"""
+    time_start = time.perf_counter()
+    load_input(job["input"])
+    armature_name = job.get("armature")
+    if not armature_name:
+        armature_name = next(o.name for o in bpy.data.objects if o.type == "ARMATURE")
+    armature = bpy.data.objects[armature_name]
+    bones = job.get("bones") or [b.name for b in armature.data.bones]
+    dst_bones = job.get("dst_bones")
+    if job.get("mapping"):
+        with open(job["mapping"]) as f:
+            pairs = [(src, dst) for src, dst in json.load(f)["pairs"] if src and dst]
+        bones, dst_bones = [src for src, _ in pairs], [dst for _, dst in pairs]
+    source = job.get("action_source", "CURRENT").upper()
+    actions = (
+        None
+        if source == "CURRENT"
+        else select_actions(armature, bones, source, job.get("action_filter", "*"))
+    )
+    fk_to_ik(
+        armature_name,
+        bones,
+        frame_start=job.get("frame_start"),
+        frame_end=job.get("frame_end"),
+        mode=job.get("mode", "replace"),
+        no_scale=job.get("no_scale", False),
+        isolate=job.get("isolate", True),
+        decimate=job.get("decimate"),
+        shards=job.get("shards", 1),
+        actions=actions,
+        export=job.get("export"),
+        step=job.get("step", 1.0),
+        fps=job.get("fps"),
+        window=job.get("window", 0),
+        dst_armature=job.get("dst_armature"),
+        dst_bone_names=dst_bones,
+    )
+    save_output(job["output"], armature_name)
+    return dict(
+        status="ok",
+        armature=armature_name,
+        bones=len(bones),
+        actions=len(actions) if actions is not None else 1,
+        seconds=time.perf_counter() - time_start,
+        profile=Profile.last.report(spans=False),  # type: ignore
+    )
+
+
+def read_manifest(path: str, defaults: dict, output_dir: str):
+    """Jobs from a JSON list of {"input", ...overrides} or a text file with one input path per line.
+    Outputs keep the inputs' directories relative to the manifest, so `a/walk.bvh` and `b/walk.bvh`
+    don't overwrite each other, jobs that would still share an output are rejected."""
+    with open(path) as f:
+        if path.lower().endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = [{"input": line.strip()} for line in f if line.strip()]
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in entries:
+        job = {**defaults, **(entry if isinstance(entry, dict) else {"input": entry})}
+        job["input"] = os.path.join(base, job["input"])
+        try:
+            relative = os.path.relpath(job["input"], base)
+        except ValueError:  # another drive
+            relative = os.pardir
+        if relative.split(os.sep)[0] == os.pardir:
+            relative = os.path.basename(job["input"])
+        stem = os.path.splitext(relative)[0]
+        job.setdefault("output", os.path.join(output_dir, f"{stem}_ik.blend"))
+        if job.pop("transforms", False):
+            job.setdefault("export", os.path.splitext(job["output"])[0] + ".fkik")
+        jobs.append(job)
+    # the job, result and log files are named after the output too
+    seen: dict[str, str] = {}
+    for job in jobs:
+        key = os.path.normcase(os.path.abspath(os.path.splitext(job["output"])[0]))
+        if key in seen:
+            raise ValueError(
+                f"'{job['input']}' and '{seen[key]}' would both write '{job['output']}'"
+            )
+        seen[key] = job["input"]
+    return jobs
+
+
+def run_worker(job: dict, timeout: float | None = None):
+    """Run one job in its own background Blender process, never raises"""
+    stem = os.path.splitext(job["output"])[0]
+    os.makedirs(os.path.dirname(os.path.abspath(stem)), exist_ok=True)
+    job_path, result_path, log_path = (
+        stem + ".job.json",
+        stem + ".result.json",
+        stem + ".log",
+    )
+    with open(job_path, "w") as f:
+        json.dump(job, f)
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    cmd = [bpy.app.binary_path, "-b", "--factory-startup"]
+    if job["input"].lower().endswith(".blend"):
+        cmd.append(job["input"])
+    cmd += [
+        "--python-exit-code",
+        "1",
+        "-P",
+        __file__,
+        "--",
+        "job",
+        job_path,
+        result_path,
+    ]
+    summary = dict(input=job["input"], output=job["output"], log=log_path)
+    time_start = time.perf_counter()
+    try:
+        with open(log_path, "w") as log:
+            proc = subprocess.run(
+                cmd, stdout=log, stderr=subprocess.STDOUT, timeout=timeout
+            )
+        summary["returncode"] = proc.returncode
+        with open(result_path) as f:
+            summary.update(json.load(f))
+    except subprocess.TimeoutExpired:
+        summary.update(status="timeout")
+    except (OSError, ValueError) as e:
+        summary.update(status="failed", error=f"no result: {e}")
+    finally:
+        os.remove(job_path)
+        if os.path.exists(result_path):
+            os.remove(result_path)
+    summary["wall_seconds"] = time.perf_counter() - time_start
+    return summary
+
+
+def run_batch(args: argparse.Namespace):
+    defaults = dict(
+        armature=args.armature,
+        bones=read_bone_list(args.bones_file) if args.bones_file else args.bones,
+        mode=args.mode,
+        shards=args.shards,
+        action_source=args.actions,
+        action_filter=args.action_filter,
+        transforms=args.transforms,
+        step=args.step,
+        fps=args.fps,
+        window=args.window,
+        dst_armature=args.target,
+        mapping=args.mapping and os.path.abspath(args.mapping),
+        decimate=(
+            (args.decimate_distance, math.radians(args.decimate_angle))
+            if args.decimate
+            else None
+        ),
+    )
+    jobs = read_manifest(args.manifest, defaults, args.output_dir)
+    Log.info(f"{len(jobs)} jobs on {args.jobs} workers")
+    summaries = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(run_worker, job, args.timeout): job for job in jobs}
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            Log.info(
+                f"[{len(summaries)}/{len(jobs)}] {summary.get('status', 'failed')}"
+                f" {summary['wall_seconds']:.1f}s {summary['input']}"
+                + (f": {summary['error']}" if summary.get("error") else "")
+            )
+    failed = [s for s in summaries if s.get("status") != "ok"]
+    report = dict(jobs=len(jobs), failed=len(failed), summaries=summaries)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(report, f, indent=2)
+    Log.info(f"done: {len(jobs) - len(failed)} ok, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+def build_synthetic_rig(
+    name: str, bones: int, depth: int, branching: int, frames: int, seed=0
+):
+    """Link an armature with a `synthetic_hierarchy` keyed with a `synthetic_take` from frame 1,
+    return (object, bone names, (frames, bones, `POSE_CHANNELS`) pose)"""
+    rest, parents, lengths = synthetic_hierarchy(bones, depth, branching, seed)
+    names = [f"Bone{i:04d}" for i in range(bones)]
+    armature = bpy.data.objects.new(name, bpy.data.armatures.new(name))
+    bpy.context.scene.collection.objects.link(armature)
+    bpy.context.view_layer.objects.active = armature
+    bpy.ops.object.mode_set(mode="EDIT")
+    edit_bones = armature.data.edit_bones
+    for i, bone_name in enumerate(names):
+        bone = edit_bones.new(bone_name)
+        bone.tail = (0, lengths[i], 0)
+        bone.matrix = Matrix(rest[i].tolist())
+        if parents[i] >= 0:
+            bone.parent = edit_bones[names[parents[i]]]
+    bpy.ops.object.mode_set(mode="OBJECT")
+
+    pose = synthetic_take(parents, frames, seed)
+    action = ensure_action(armature)
+    channels = {
+        bone_name: unpack_pose(pose[:, i], "QUATERNION")
+        for i, bone_name in enumerate(names)
+    }
+    write_channels(action, np.arange(1, frames + 1), channels)
+    scene = bpy.context.scene
+    scene.frame_start, scene.frame_end = 1, frames
+    return armature, names, pose
+
+
+def read_baked(armature: bpy.types.Object, bone_names: list[str], frames):
+    """(frames, bones, 4, 4) local matrices keyed on the bones in the current action"""
+    index = FCurveIndex(ensure_action(armature))
+    local = np.empty((len(frames), len(bone_names), 4, 4))
+    for b, bone_name in enumerate(bone_names):
+        mode, channels = bone_samplers(index, armature.pose.bones[bone_name])
+        local[:, b] = channels_to_matrices(sample_channels(channels, frames), mode)
+    return local
+
+
+def run_bench(args: argparse.Namespace):
+    """Time `fk_to_ik` on a grid of synthetic rigs and takes, and check that every mode and
+    run keys the same motion as `fktoikcore.fk_to_ik`"""
+    results = []
+    ok = True
+    for bones, depth, frames in itertools.product(args.bones, args.depth, args.frames):
+        config = dict(bones=bones, depth=depth, branching=args.branching, frames=frames)
+        frame_times = np.arange(1, frames + 1, dtype=np.float64)
+        modes = {}
+        baked_first = {}
+        for mode in args.modes:
+            seconds, errors, run_errors, profile = [], [], [], None
+            for run in range(args.repeat):
+                bpy.ops.wm.read_factory_settings(use_empty=True)
+                armature, names, pose = build_synthetic_rig(
+                    "Bench", bones, depth, args.branching, frames, args.seed
+                )
+                # the rest pose as Blender stores it, not as generated
+                data_index = {b.name: i for i, b in enumerate(armature.data.bones)}
+                name_index = {name: i for i, name in enumerate(names)}
+                rest = read_matrices(armature.data.bones, "matrix_local")
+                rest = rest[[data_index[name] for name in names]]
+                parents = np.array(
+                    [
+                        name_index[b.parent.name] if b.parent else -1
+                        for b in (armature.data.bones[name] for name in names)
+                    ]
+                )
+                time_start = time.perf_counter()
+                fk_to_ik(armature.name, names, mode=mode)
+                seconds.append(time.perf_counter() - time_start)
+                profile = profile or Profile.last.report(spans=False)  # type: ignore
+                baked_names = names if mode == "replace" else [n + ".IK" for n in names]
+                baked = read_baked(armature, baked_names, frame_times)
+                reference = fk_to_ik_arrays(rest, parents, pose, range(bones))
+                errors.append(float(np.abs(baked - reference).max()))
+                if run == 0:
+                    baked_first[mode] = baked
+                else:
+                    run_errors.append(float(np.abs(baked - baked_first[mode]).max()))
+            modes[mode] = dict(
+                seconds=seconds,
+                best=min(seconds),
+                median=float(np.median(seconds)),
+                us_per_bone_frame=min(seconds) / (bones * frames) * 1e6,
+                error=max(errors),
+                run_error=max(run_errors, default=0.0),
+                profile=profile,
+            )
+            ok &= modes[mode]["error"] <= args.tolerance
+            ok &= modes[mode]["run_error"] <= args.tolerance
+            Log.info(
+                f"{bones} bones, depth {depth}, {frames} frames, {mode}:"
+                f" {modes[mode]['best']:.3f}s, error {modes[mode]['error']:.2e}"
+            )
+        mode_error = 0.0
+        if len(baked_first) > 1:
+            first, *others = baked_first.values()
+            mode_error = max(float(np.abs(b - first).max()) for b in others)
+            ok &= mode_error <= args.tolerance
+        results.append(dict(config, modes=modes, mode_error=mode_error))
+    report = dict(
+        blender=bpy.app.version_string,
+        seed=args.seed,
+        repeat=args.repeat,
+        tolerance=args.tolerance,
+        ok=bool(ok),
+        results=results,
+    )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    Log.info(f"{'ok' if ok else 'MISMATCH'}, results written to {args.output}")
+    return 0 if ok else 1
+
+
+def run_job_cli(args: argparse.Namespace):
+    with open(args.job) as f:
+        job = json.load(f)
+    try:
+        result = run_job(job)
+    except Exception as e:
+        Log.error(traceback.format_exc())
+        result = dict(status="failed", error=f"{type(e).__name__}: {e}")
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+    return 0 if result["status"] == "ok" else 1
+
+
+def run_shard_cli(args: argparse.Namespace):
+    """Sample a frame range of the opened file for `sample_pose_sharded`"""
+    with open(args.spec) as f:
+        spec = json.load(f)
+    armature = bpy.data.objects[spec["armature"]]
+    world = drain(
+        sample_pose_matrices(
+            armature, spec["bones"], args.frame_start, args.frame_end, args.step
+        )
+    )
+    np.save(args.output, world[:, :, :3].astype(np.float32))
+    return 0
+
+
+def parse_args(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog=f"blender -b -P {SELF} --", description="Batch FK to IK conversion"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    batch = sub.add_parser("batch", help="convert every take of a manifest in parallel")
+    batch.add_argument(
+        "manifest", help=".json list of jobs, or a text file with one input per line"
+    )
+    batch.add_argument("-o", "--output-dir", default="fktoik_output")
+    batch.add_argument(
+        "-a", "--armature", help="armature object name, default: the first armature"
+    )
+    bones = batch.add_mutually_exclusive_group()
+    bones.add_argument("-b", "--bones", nargs="+", help="default: all bones")
+    bones.add_argument("--bones-file", help="text file with one bone name per line")
+    batch.add_argument("-m", "--mode", choices=["replace", "append"], default="replace")
+    batch.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    batch.add_argument("--timeout", type=float, help="seconds per job")
+    batch.add_argument("--decimate", action="store_true")
+    batch.add_argument("--decimate-distance", type=float, default=0.001)
+    batch.add_argument("--decimate-angle", type=float, default=0.1, help="degrees")
+    batch.add_argument("--shards", type=int, default=1, help="processes per job")
+    resample = batch.add_mutually_exclusive_group()
+    resample.add_argument(
+        "--step", type=float, default=1.0, help="frames between baked keys"
+    )
+    resample.add_argument("--fps", type=float, help="bake at this frame rate")
+    batch.add_argument(
+        "--window", type=int, default=0, help="keys baked at a time on long takes"
+    )
+    batch.add_argument(
+        "--target", help="retarget onto this armature of the take's file instead"
+    )
+    batch.add_argument(
+        "--mapping", help="mapping preset .json pairing source and --target bones"
+    )
+    batch.add_argument(
+        "--actions",
+        choices=["current", "all", "nla"],
+        default="current",
+        help="convert the active action, every action keying the bones, or the NLA strips' actions",
+    )
+    batch.add_argument(
+        "--action-filter", default="*", help="wildcard pattern on action names"
+    )
+    batch.add_argument(
+        "--transforms",
+        action="store_true",
+        help="also write the baked transforms next to each output as .fkik",
+    )
+    batch.add_argument("--summary", help="write the per-job summary as JSON")
+    batch.set_defaults(func=run_batch)
+    job = sub.add_parser("job", help="internal: run one job in this process")
+    job.add_argument("job")
+    job.add_argument("result")
+    job.set_defaults(func=run_job_cli)
+    shard = sub.add_parser(
+        "shard", help="internal: sample a frame range of the opened file"
+    )
+    shard.add_argument("spec", help=".json with the armature and bone names")
+    shard.add_argument("output")
+    shard.add_argument("frame_start", type=float)
+    shard.add_argument("frame_end", type=float)
+    shard.add_argument("--step", type=float, default=1.0)
+    shard.set_defaults(func=run_shard_cli)
+    bench = sub.add_parser(
+        "bench", help="time the conversion on synthetic rigs and check its output"
+    )
+    bench.add_argument("--bones", type=int, nargs="+", default=[16, 64, 256])
+    bench.add_argument(
+        "--depth", type=int, nargs="+", default=[8], help="max bones per chain"
+    )
+    bench.add_argument("--branching", type=int, default=2, help="max children per bone")
+    bench.add_argument("--frames", type=int, nargs="+", default=[250])
+    bench.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["replace", "append"],
+        default=["replace", "append"],
+    )
+    bench.add_argument("--repeat", type=int, default=3, help="runs per configuration")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-4,
+        help="max matrix difference between modes, runs and the NumPy reference",
+    )
+    bench.add_argument("-o", "--output", default="fktoik_bench.json")
+    bench.set_defaults(func=run_bench)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]):
+    args = parse_args(argv)
+    sys.exit(args.func(args))
+
+
 if __name__ == "__main__":
-    register()
+    if "--" in sys.argv:
+        main(sys.argv[sys.argv.index("--") + 1 :])
+    else:
+        register()
@@ -0,0 +1,1410 @@
+"""Blender independent core of the FK to IK conversion: batched transform math, forward kinematics,
+F-curve evaluation and key reduction on NumPy arrays. `fktoikaddon` is a thin bpy adapter over it,
+and it can be used as is from plain Python, e.g. to convert mocap in pipeline workers:
+
+    local = fk_to_ik(rest, parents, pose, bones=[3, 7], rotation_modes="XYZ")
+
+Run `python fktoikcore.py bvh --help` to convert BVH takes from the command line.
+"""
+
+import re
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import numpy as np
+from contextlib import contextmanager
+from typing import Callable, Sequence
+
+EULER_ORDERS = {
+    # order: (i, j, k, parity), same table as Blender's `rotOrders`
+    "XYZ": (0, 1, 2, 0),
+    "XZY": (0, 2, 1, 1),
+    "YXZ": (1, 0, 2, 1),
+    "YZX": (1, 2, 0, 0),
+    "ZXY": (2, 0, 1, 0),
+    "ZYX": (2, 1, 0, 1),
+}
+
+
+INTERPOLATION = {"CONSTANT": 0, "LINEAR": 1, "BEZIER": 2}
+
+
+def decompose_matrices(matrices: np.ndarray):
+    """Batched `Matrix.decompose`: (..., 4, 4) -> location (..., 3), rotation (..., 3, 3), scale (..., 3)"""
+    loc = matrices[..., :3, 3].copy()
+    basis = matrices[..., :3, :3]
+    scale = np.linalg.norm(basis, axis=-2)
+    scale[scale == 0] = 1.0
+    rot = basis / scale[..., None, :]
+    negative = np.linalg.det(basis) < 0
+    rot[negative] *= -1
+    scale[negative] *= -1
+    return loc, rot, scale
+
+
+def matrices_to_quaternions(rot: np.ndarray):
+    """Batched `Matrix.to_quaternion`: (..., 3, 3) -> (..., 4) as w, x, y, z"""
+    m = rot
+    trace = m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2]
+    quat = np.empty(rot.shape[:-2] + (4,))
+    # Shepperd's method: pick the largest of w, x, y, z for numerical stability
+    pick = np.argmax(
+        np.stack(
+            [
+                trace,
+                m[..., 0, 0] - m[..., 1, 1] - m[..., 2, 2],
+                m[..., 1, 1] - m[..., 0, 0] - m[..., 2, 2],
+                m[..., 2, 2] - m[..., 0, 0] - m[..., 1, 1],
+            ],
+            axis=-1,
+        ),
+        axis=-1,
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s = np.sqrt(np.maximum(1.0 + trace, 0)) * 2
+        q0 = np.stack(
+            [
+                0.25 * s,
+                (m[..., 2, 1] - m[..., 1, 2]) / s,
+                (m[..., 0, 2] - m[..., 2, 0]) / s,
+                (m[..., 1, 0] - m[..., 0, 1]) / s,
+            ],
+            axis=-1,
+        )
+        s = np.sqrt(np.maximum(1.0 + m[..., 0, 0] - m[..., 1, 1] - m[..., 2, 2], 0)) * 2
+        q1 = np.stack(
+            [
+                (m[..., 2, 1] - m[..., 1, 2]) / s,
+                0.25 * s,
+                (m[..., 0, 1] + m[..., 1, 0]) / s,
+                (m[..., 0, 2] + m[..., 2, 0]) / s,
+            ],
+            axis=-1,
+        )
+        s = np.sqrt(np.maximum(1.0 + m[..., 1, 1] - m[..., 0, 0] - m[..., 2, 2], 0)) * 2
+        q2 = np.stack(
+            [
+                (m[..., 0, 2] - m[..., 2, 0]) / s,
+                (m[..., 0, 1] + m[..., 1, 0]) / s,
+                0.25 * s,
+                (m[..., 1, 2] + m[..., 2, 1]) / s,
+            ],
+            axis=-1,
+        )
+        s = np.sqrt(np.maximum(1.0 + m[..., 2, 2] - m[..., 0, 0] - m[..., 1, 1], 0)) * 2
+        q3 = np.stack(
+            [
+                (m[..., 1, 0] - m[..., 0, 1]) / s,
+                (m[..., 0, 2] + m[..., 2, 0]) / s,
+                (m[..., 1, 2] + m[..., 2, 1]) / s,
+                0.25 * s,
+            ],
+            axis=-1,
+        )
+    for i, q in enumerate((q0, q1, q2, q3)):
+        quat[pick == i] = q[pick == i]
+    # Blender keeps w positive
+    quat[quat[..., 0] < 0] *= -1
+    return quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+
+
+def quaternions_compatible(quat: np.ndarray, axis=0):
+    """Batched `Quaternion.make_compatible` along the frame axis, flip signs so neighbours never jump"""
+    quat = np.moveaxis(quat, axis, 0)
+    dots = np.einsum("f...i,f...i->f...", quat[1:], quat[:-1])
+    signs = np.ones(quat.shape[:-1])
+    signs[1:] = np.cumprod(np.where(dots < 0, -1.0, 1.0), axis=0)
+    return np.moveaxis(quat * signs[..., None], 0, axis)
+
+
+def matrices_to_eulers(rot: np.ndarray, order="XYZ", axis=0):
+    """Batched `Matrix.to_euler(order, compat)`: (..., 3, 3) -> (..., 3), unwrapped along the frame axis"""
+    i, j, k, parity = EULER_ORDERS[order]
+    # Blender indexes matrices as mat[col][row]
+    mat = lambda c, r: rot[..., r, c]  # noqa: E731
+    cy = np.hypot(mat(i, i), mat(i, j))
+    gimbal = cy <= 16 * np.finfo(np.float32).eps
+    eul = np.empty(rot.shape[:-2] + (3,))
+    eul[..., i] = np.where(
+        gimbal, np.arctan2(-mat(k, j), mat(j, j)), np.arctan2(mat(j, k), mat(k, k))
+    )
+    eul[..., j] = np.arctan2(-mat(i, k), cy)
+    eul[..., k] = np.where(gimbal, 0.0, np.arctan2(mat(i, j), mat(i, i)))
+    if parity:
+        eul = -eul
+    return np.unwrap(eul, axis=axis) if eul.ndim > 1 else eul
+
+
+def quaternions_to_axis_angles(quat: np.ndarray):
+    """(..., 4) w, x, y, z -> (..., 4) angle, x, y, z like `PoseBone.rotation_axis_angle`"""
+    w = np.clip(quat[..., 0], -1.0, 1.0)
+    angle = 2 * np.arccos(w)
+    sin = np.sqrt(np.maximum(1 - w * w, 0))
+    axis = np.where(
+        sin[..., None] > 1e-8,
+        quat[..., 1:] / np.where(sin > 1e-8, sin, 1.0)[..., None],
+        np.array([0.0, 1.0, 0.0]),
+    )
+    return np.concatenate([angle[..., None], axis], axis=-1)
+
+
+def rotation_channel(rotation_mode: str):
+    """(data_path, length) of the rotation channel used by the bone's rotation mode"""
+    if rotation_mode == "QUATERNION":
+        return "rotation_quaternion", 4
+    if rotation_mode == "AXIS_ANGLE":
+        return "rotation_axis_angle", 4
+    return "rotation_euler", 3
+
+
+def matrices_to_channels(matrices: np.ndarray, rotation_mode: str, no_scale=False):
+    """Decompose (frames, 4, 4) local matrices of one bone into {prop: (frames, n)} channel arrays,
+    rotations are kept continuous over frames like visual keying does."""
+    loc, rot, scale = decompose_matrices(matrices)
+    rot_path, _ = rotation_channel(rotation_mode)
+    if rotation_mode in EULER_ORDERS:
+        rotation = matrices_to_eulers(rot, rotation_mode)
+    else:
+        rotation = quaternions_compatible(matrices_to_quaternions(rot))
+        if rotation_mode == "AXIS_ANGLE":
+            rotation = quaternions_to_axis_angles(rotation)
+    channels = {"location": loc, rot_path: rotation}
+    if not no_scale:
+        channels["scale"] = scale
+    return channels
+
+
+def quaternions_to_matrices(quat: np.ndarray):
+    """Batched `Quaternion.to_matrix`: (..., 4) w, x, y, z -> (..., 3, 3), normalizes like pose evaluation does"""
+    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    w, x, y, z = np.moveaxis(quat, -1, 0)
+    return np.stack(
+        [
+            np.stack(
+                [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], -1
+            ),
+            np.stack(
+                [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], -1
+            ),
+            np.stack(
+                [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], -1
+            ),
+        ],
+        axis=-2,
+    )
+
+
+def eulers_to_matrices(eul: np.ndarray, order="XYZ"):
+    """Batched `Euler.to_matrix`: (..., 3) -> (..., 3, 3), the first axis of `order` is applied first"""
+    cos, sin = np.cos(eul), np.sin(eul)
+    one, zero = np.ones(eul.shape[:-1]), np.zeros(eul.shape[:-1])
+    axes = {
+        "X": lambda c, s: [[one, zero, zero], [zero, c, -s], [zero, s, c]],
+        "Y": lambda c, s: [[c, zero, s], [zero, one, zero], [-s, zero, c]],
+        "Z": lambda c, s: [[c, -s, zero], [s, c, zero], [zero, zero, one]],
+    }
+    mat = np.broadcast_to(np.eye(3), eul.shape[:-1] + (3, 3))
+    for axis in order:
+        i = "XYZ".index(axis)
+        rows = axes[axis](cos[..., i], sin[..., i])
+        mat = np.stack([np.stack(row, -1) for row in rows], -2) @ mat
+    return mat
+
+
+def axis_angles_to_matrices(axis_angle: np.ndarray):
+    """(..., 4) angle, x, y, z -> (..., 3, 3)"""
+    angle, axis = axis_angle[..., 0], axis_angle[..., 1:]
+    norm = np.linalg.norm(axis, axis=-1, keepdims=True)
+    axis = np.where(norm > 1e-8, axis / np.where(norm > 1e-8, norm, 1.0), 0.0)
+    half = angle[..., None] / 2
+    quat = np.concatenate([np.cos(half), axis * np.sin(half)], axis=-1)
+    quat[norm[..., 0] <= 1e-8] = (1, 0, 0, 0)
+    return quaternions_to_matrices(quat)
+
+
+def rotations_to_matrices(rotation: np.ndarray, rotation_mode: str):
+    """(..., 3 or 4) rotation channel values of `rotation_mode` -> (..., 3, 3)"""
+    if rotation_mode in EULER_ORDERS:
+        return eulers_to_matrices(rotation, rotation_mode)
+    if rotation_mode == "AXIS_ANGLE":
+        return axis_angles_to_matrices(rotation)
+    return quaternions_to_matrices(rotation)
+
+
+def channels_to_matrices(channels: dict[str, np.ndarray], rotation_mode: str):
+    """Inverse of `matrices_to_channels`: {prop: (..., n)} -> (..., 4, 4) basis matrices, T @ R @ S"""
+    rot_path, _ = rotation_channel(rotation_mode)
+    rotation = channels[rot_path]
+    rot = rotations_to_matrices(rotation, rotation_mode)
+    scale = channels.get("scale", np.ones(rotation.shape[:-1] + (3,)))
+    mat = np.zeros(rotation.shape[:-1] + (4, 4))
+    mat[..., :3, :3] = rot * scale[..., None, :]
+    mat[..., :3, 3] = channels["location"]
+    mat[..., 3, 3] = 1
+    return mat
+
+
+def hierarchy_levels(parents: np.ndarray):
+    """Group bone indices by depth, so every level only depends on the levels before it"""
+    depth = np.full(len(parents), -1)
+    for i in range(len(parents)):
+        chain = []
+        while i >= 0 and depth[i] < 0:
+            chain.append(i)
+            i = parents[i]
+        d = depth[i] if i >= 0 else -1
+        for j in reversed(chain):
+            d += 1
+            depth[j] = d
+    return [np.flatnonzero(depth == d) for d in range(depth.max() + 1)]
+
+
+def forward_kinematics(rest: np.ndarray, parents: np.ndarray, basis: np.ndarray):
+    """Armature-space pose matrices (frames, bones, 4, 4) from rest matrices (bones, 4, 4),
+    parent indices (-1 for roots) and local basis matrices (frames, bones, 4, 4):
+    `world = parent_world @ parent_rest⁻¹ @ rest @ basis`, the default full inheritance.
+    Bones are evaluated level by level, so every ancestor is computed once per frame and
+    its matrix is shared by all of its descendants."""
+    parents = np.asarray(parents)
+    offset = rest.copy()
+    has_parent = parents >= 0
+    offset[has_parent] = np.linalg.inv(rest[parents[has_parent]]) @ rest[has_parent]
+    local = offset[None] @ basis
+    world = np.empty_like(local)
+    for level in hierarchy_levels(parents):
+        roots = level[parents[level] < 0]
+        children = level[parents[level] >= 0]
+        world[:, roots] = local[:, roots]
+        world[:, children] = world[:, parents[children]] @ local[:, children]
+    return world
+
+
+def bezier(p0, p1, p2, p3, t):
+    u = 1 - t
+    return u * u * u * p0 + 3 * u * u * t * p1 + 3 * u * t * t * p2 + t * t * t * p3
+
+
+def bezier_derivative(p0, p1, p2, p3, t):
+    u = 1 - t
+    return 3 * u * u * (p1 - p0) + 6 * u * t * (p2 - p1) + 3 * t * t * (p3 - p2)
+
+
+def solve_bezier(x0, x1, x2, x3, target):
+    """Parameter t where the monotonic x(t) of the Bezier segments reaches `target`.
+    Safeguarded Newton, bisects whenever a step leaves the bracket."""
+    lo, hi = np.zeros(len(target)), np.ones(len(target))
+    t = (target - x0) / np.where(x3 > x0, x3 - x0, 1.0)
+    for _ in range(8):
+        dx = bezier(x0, x1, x2, x3, t) - target
+        lo, hi = np.where(dx < 0, t, lo), np.where(dx < 0, hi, t)
+        slope = bezier_derivative(x0, x1, x2, x3, t)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = t - dx / slope
+        t = np.where((step >= lo) & (step <= hi), step, (lo + hi) / 2)
+    return t
+
+
+def evaluate_shared_keys(x, y, handle_left, handle_right, frames):
+    """`evaluate_keys` of BEZIER curves sharing their key frames and handle lengths, like the
+    channels of one property after `fit_bezier_handles`: x (keys,), y (keys, n),
+    handles (keys, n, 2) -> (frames, n). The curve parameter is solved once for all of them.
+    """
+    seg = np.clip(np.searchsorted(x, frames, side="right") - 1, 0, len(x) - 2)
+    p0, p3 = x[seg], x[seg + 1]
+    h1, h2 = p0 - handle_right[seg, 0, 0], p3 - handle_left[seg + 1, 0, 0]
+    fac = bezpart_factor(p0, p3, h1, h2)[:, None]
+    t = solve_bezier(p0, p0 - fac[:, 0] * h1, p3 - fac[:, 0] * h2, p3, frames)
+    p0, p3 = y[seg], y[seg + 1]
+    h1, h2 = p0 - handle_right[seg, :, 1], p3 - handle_left[seg + 1, :, 1]
+    return bezier(p0, p0 - fac * h1, p3 - fac * h2, p3, t[:, None])
+
+
+def bezpart_factor(x0, x3, h1, h2):
+    """`BKE_fcurve_correct_bezpart`: handle scale that keeps x(t) monotonic"""
+    total = np.abs(h1) + np.abs(h2)
+    return np.where(total > x3 - x0, (x3 - x0) / np.where(total > 0, total, 1), 1.0)
+
+
+def evaluate_keys(
+    co: np.ndarray,
+    handle_left: np.ndarray,
+    handle_right: np.ndarray,
+    ipo: np.ndarray,
+    frames: np.ndarray,
+    extrapolation="CONSTANT",
+):
+    """Vectorized `FCurve.evaluate` for CONSTANT, LINEAR and BEZIER keys.
+    `co`/handles are (keys, 2), `ipo` (keys,) `INTERPOLATION` codes, returns (frames,)
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    x, y = co[:, 0], co[:, 1]
+    if len(co) < 2:
+        return np.full(len(frames), y[0] if len(co) else 0.0)
+    seg = np.clip(np.searchsorted(x, frames, side="right") - 1, 0, len(co) - 2)
+    x0, x3, y0, y3 = x[seg], x[seg + 1], y[seg], y[seg + 1]
+    width = np.where(x3 > x0, x3 - x0, 1.0)
+    result = np.where(
+        ipo[seg] == INTERPOLATION["CONSTANT"],
+        y0,
+        y0 + (y3 - y0) * (frames - x0) / width,
+    )
+    is_bezier = ipo[seg] == INTERPOLATION["BEZIER"]
+    if is_bezier.any():
+        k = seg[is_bezier]
+        p0, p3 = co[k], co[k + 1]
+        h1, h2 = p0 - handle_right[k], p3 - handle_left[k + 1]
+        fac = bezpart_factor(p0[:, 0], p3[:, 0], h1[:, 0], h2[:, 0])
+        p1, p2 = p0 - fac[:, None] * h1, p3 - fac[:, None] * h2
+        t = solve_bezier(p0[:, 0], p1[:, 0], p2[:, 0], p3[:, 0], frames[is_bezier])
+        result[is_bezier] = bezier(p0[:, 1], p1[:, 1], p2[:, 1], p3[:, 1], t)
+
+    before, after = frames < x[0], frames >= x[-1]
+    slope_first = slope_last = 0.0
+    if extrapolation == "LINEAR":
+        slope_first = _extrapolation_slope(co[0], co[1], handle_left[0], ipo[0])
+        slope_last = _extrapolation_slope(co[-1], co[-2], handle_right[-1], ipo[-1])
+    result[before] = y[0] + slope_first * (frames[before] - x[0])
+    result[after] = y[-1] + slope_last * (frames[after] - x[-1])
+    return result
+
+
+def _extrapolation_slope(key, neighbor, handle, ipo):
+    if ipo == INTERPOLATION["CONSTANT"]:
+        return 0.0
+    other = handle if ipo == INTERPOLATION["BEZIER"] else neighbor
+    dx = key[0] - other[0]
+    return (key[1] - other[1]) / dx if dx else 0.0
+
+
+def fit_bezier_handles(
+    frames: np.ndarray, values: np.ndarray, keys: np.ndarray, slope=None
+):
+    """Aligned handles for the key indices into dense (frames, n) samples: along the dense
+    curve's slope, a third of the neighbouring segment long. Returns 2 × (keys, n, 2)"""
+    if slope is None:
+        slope = np.gradient(values, frames, axis=0)
+    slope = slope[keys]
+    x, y = frames[keys], values[keys]
+    left = np.diff(x, prepend=x[0]) / 3
+    right = np.diff(x, append=x[-1]) / 3
+    left[0], right[-1] = right[0], left[-1]
+    x = np.broadcast_to(x[:, None], y.shape)
+    handle_left = np.stack([x - left[:, None], y - slope * left[:, None]], -1)
+    handle_right = np.stack([x + right[:, None], y + slope * right[:, None]], -1)
+    return handle_left, handle_right
+
+
+def decimate_samples(
+    frames: np.ndarray,
+    values: np.ndarray,
+    error: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    tolerance: float,
+):
+    """Fewest shared key indices, with fitted Bezier handles, that reproduce the dense (frames, n)
+    samples within `tolerance`, where `error(approx, values)` gives the deviation per frame.
+    Starts from the end points, each pass inserts the worst frame of every segment still out of
+    tolerance. A segment only depends on its two keys, so accepted segments are never evaluated again.
+    Returns (keys, handle_left, handle_right)."""
+    n = len(frames)
+    if n < 3:
+        keys = np.arange(n)
+        if n < 2:
+            point = np.stack(
+                [np.broadcast_to(frames[:, None], values.shape), values], -1
+            )
+            return keys, point, point
+        return (keys, *fit_bezier_handles(frames, values, keys))
+    slope = np.gradient(values, frames, axis=0)
+    keys = np.array([0, n - 1])
+    pending = np.arange(n)
+    while len(pending):
+        handle_left, handle_right = fit_bezier_handles(frames, values, keys, slope)
+        approx = evaluate_shared_keys(
+            frames[keys], values[keys], handle_left, handle_right, frames[pending]
+        )
+        deviation = error(approx, values[pending])
+        segment = np.searchsorted(keys, pending, side="right") - 1
+        order = np.lexsort((-deviation, segment))
+        first = order[np.r_[True, segment[order][1:] != segment[order][:-1]]]
+        first = first[deviation[first] > tolerance]
+        worst = np.setdiff1d(pending[first], keys)
+        if not len(worst):
+            break
+        keys = np.union1d(keys, worst)
+        pending = pending[np.isin(segment, segment[first])]
+    return (keys, *fit_bezier_handles(frames, values, keys, slope))
+
+
+def distance_error(approx: np.ndarray, values: np.ndarray):
+    return np.linalg.norm(approx - values, axis=-1)
+
+
+def max_error(approx: np.ndarray, values: np.ndarray):
+    return np.abs(approx - values).max(axis=-1)
+
+
+def rotation_error(rotation_mode: str):
+    """Angle between the approximated and the dense rotations, in radians"""
+
+    def error(approx: np.ndarray, values: np.ndarray):
+        a = rotations_to_matrices(approx, rotation_mode)
+        b = rotations_to_matrices(values, rotation_mode)
+        cos = (np.einsum("...ij,...ij->...", a, b) - 1) / 2
+        return np.arccos(np.clip(cos, -1.0, 1.0))
+
+    return error
+
+
+def sample_frames(frame_start: float, frame_end: float, step=1.0):
+    """Sample times from `frame_start` to `frame_end` included every `step` frames,
+    fractional times are subframes"""
+    count = int(np.floor((frame_end - frame_start) / step + 1e-6)) + 1
+    return frame_start + np.arange(max(count, 0)) * step
+
+
+def rotations_compatible(
+    rotation: np.ndarray, previous: np.ndarray, rotation_mode: str
+):
+    """Continue (frames, n) rotation channels from the `previous` (n,) value, so keys baked over
+    part of a range don't jump against the kept ones: Euler angles are shifted by whole turns,
+    quaternions flip sign. Axis-angle channels are returned as is."""
+    if rotation_mode in EULER_ORDERS:
+        return rotation + 2 * np.pi * np.round((previous - rotation[0]) / (2 * np.pi))
+    if rotation_mode == "QUATERNION" and np.dot(rotation[0], previous) < 0:
+        return -rotation
+    return rotation
+
+
+def block_hashes(values: np.ndarray, block=16, seed=b""):
+    """Content hash of every `block` frames of (frames, ...) sampled values, prefixed by `seed`"""
+    values = np.ascontiguousarray(values)
+    return [
+        hashlib.blake2b(
+            seed + values[lo : lo + block].tobytes(), digest_size=8
+        ).hexdigest()
+        for lo in range(0, len(values), block)
+    ]
+
+
+def changed_ranges(
+    old: Sequence[str], new: Sequence[str], frame_start: int, frame_end: int, block=16
+):
+    """Merged (start, end) frame ranges of the blocks whose `block_hashes` differ,
+    blocks missing from `old` count as changed"""
+    return merge_ranges(
+        [
+            (frame_start + i * block, min(frame_start + (i + 1) * block - 1, frame_end))
+            for i, digest in enumerate(new)
+            if i >= len(old) or old[i] != digest
+        ]
+    )
+
+
+def merge_ranges(ranges: Sequence[tuple[int, int]]):
+    """Sorted union of inclusive (start, end) frame ranges, touching ranges are joined"""
+    merged: list[tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+POSE_CHANNELS = 10
+"""Channels per bone of a pose array: location xyz, rotation, scale xyz. The rotation is a w, x, y, z
+quaternion, an angle, x, y, z axis-angle, or xyz Euler angles followed by an unused value."""
+
+
+def pose_to_matrices(
+    pose: np.ndarray, rotation_modes: str | Sequence[str] = "QUATERNION"
+):
+    """(frames, bones, `POSE_CHANNELS`) pose channels -> (frames, bones, 4, 4) basis matrices.
+    `rotation_modes` is a single mode for every bone or one mode per bone."""
+    if isinstance(rotation_modes, str):
+        rotation_modes = [rotation_modes] * pose.shape[1]
+    basis = np.empty(pose.shape[:-1] + (4, 4))
+    for mode in set(rotation_modes):
+        idx = [b for b, m in enumerate(rotation_modes) if m == mode]
+        basis[:, idx] = channels_to_matrices(unpack_pose(pose[:, idx], mode), mode)
+    return basis
+
+
+def pack_pose(channels: dict[str, np.ndarray], rotation_mode: str):
+    """{prop: (..., n)} channels of one rotation mode -> (..., `POSE_CHANNELS`)"""
+    rot_path, n = rotation_channel(rotation_mode)
+    rotation = channels[rot_path]
+    pose = np.zeros(rotation.shape[:-1] + (POSE_CHANNELS,))
+    pose[..., :3] = channels["location"]
+    pose[..., 3 : 3 + n] = rotation
+    pose[..., 7:10] = channels.get("scale", 1.0)
+    return pose
+
+
+def unpack_pose(pose: np.ndarray, rotation_mode: str):
+    """(..., `POSE_CHANNELS`) -> {prop: (..., n)} channels of the rotation mode"""
+    rot_path, n = rotation_channel(rotation_mode)
+    return {
+        "location": pose[..., :3],
+        rot_path: pose[..., 3 : 3 + n],
+        "scale": pose[..., 7:10],
+    }
+
+
+def chain_subset(parents: np.ndarray, bones: Sequence[int]):
+    """The bones plus all of their ancestors: (chain indices, parent indices into the chain,
+    position of every bone in the chain), so only the needed part of a hierarchy is evaluated
+    """
+    parents = np.asarray(parents)
+    keep = np.zeros(len(parents), dtype=bool)
+    for i in bones:
+        while i >= 0 and not keep[i]:
+            keep[i] = True
+            i = parents[i]
+    chain = np.flatnonzero(keep)
+    remap = np.full(len(parents), -1)
+    remap[chain] = np.arange(len(chain))
+    chain_parents = np.where(parents[chain] >= 0, remap[parents[chain]], -1)
+    return chain, chain_parents, remap[np.asarray(bones, dtype=int)]
+
+
+def unparent(rest: np.ndarray, world: np.ndarray, no_scale=False):
+    """Local (frames, bones, 4, 4) transforms keeping the armature-space `world` matrices of bones
+    with no parent: `rest⁻¹ @ world`. `no_scale` drops the scale, like copying location and rotation only.
+    """
+    if no_scale:
+        world = world.copy()
+        world[..., :3, :3] /= np.linalg.norm(world[..., :3, :3], axis=-2)[..., None, :]
+    return np.linalg.inv(rest)[None] @ world
+
+
+def fk_to_ik(
+    rest: np.ndarray,
+    parents: np.ndarray,
+    pose: np.ndarray,
+    bones: Sequence[int],
+    rotation_modes: str | Sequence[str] = "QUATERNION",
+    no_scale=False,
+):
+    """Convert the FK motion of a hierarchy to unparented transforms of a subset of its bones.
+
+    `rest` (bones, 4, 4) armature-space rest matrices, `parents` (bones,) parent indices, -1 for roots,
+    `pose` (frames, bones, `POSE_CHANNELS`) channels in `rotation_modes`, or (frames, bones, 4, 4) basis
+    matrices. Returns the (frames, len(bones), 4, 4) local matrices that reproduce the bones' motion
+    once their parents are cleared, split them into keys with `matrices_to_channels`."""
+    chain, chain_parents, selected = chain_subset(parents, bones)
+    if pose.ndim == 3:
+        if not isinstance(rotation_modes, str):
+            rotation_modes = [rotation_modes[i] for i in chain]
+        basis = pose_to_matrices(pose[:, chain], rotation_modes)
+    else:
+        basis = pose[:, chain]
+    world = forward_kinematics(rest[chain], chain_parents, basis)
+    return unparent(rest[np.asarray(bones, dtype=int)], world[:, selected], no_scale)
+
+
+def retarget_offsets(
+    src_rest: np.ndarray, dst_rest: np.ndarray, src_to_dst: np.ndarray = np.eye(4)
+):
+    """(pairs, 4, 4) rest offsets of source → destination bone pairs, computed once per rig pair:
+    `(src_to_dst @ src_rest)⁻¹ @ dst_rest`, so that `src_to_dst @ src_world @ offset` is the
+    destination bone's armature-space pose, its rest pose when the source bone is at rest.
+    `src_to_dst` maps the source armature's space into the destination's."""
+    return np.linalg.inv(src_to_dst @ src_rest) @ dst_rest
+
+
+def retarget(
+    src_world: np.ndarray,
+    offsets: np.ndarray,
+    dst_rest: np.ndarray,
+    dst_parents: np.ndarray,
+    dst_parent_rest: np.ndarray,
+    src_to_dst: np.ndarray = np.eye(4),
+    no_scale=False,
+    child_locations=False,
+):
+    """Local basis matrices (frames, pairs, 4, 4) moving destination bones like the source bones'
+    armature-space `src_world` (frames, pairs, 4, 4), in one batch over all frames and pairs.
+
+    `offsets` come from `retarget_offsets`, `dst_rest` are the destination bones' rest matrices,
+    `dst_parents` the pair index of each destination bone's nearest retargeted ancestor, -1 if
+    there is none, `dst_parent_rest` the rest matrices of the direct parents, identity for roots.
+    Bones in between aren't keyed and stay at rest relative to that ancestor, so a parent moves as
+    `ancestor_world @ ancestor_rest⁻¹ @ parent_rest`, without a retargeted ancestor it's at rest.
+    With default inheritance, `basis = rest⁻¹ @ parent_rest @ parent_world⁻¹ @ world`. Below the
+    retargeted roots only rotations follow, so the target keeps its proportions, unless
+    `child_locations`."""
+    world = src_to_dst @ src_world @ offsets[None]
+    if no_scale:
+        world[..., :3, :3] /= np.linalg.norm(world[..., :3, :3], axis=-2)[..., None, :]
+    dst_parents = np.asarray(dst_parents)
+    parent_world = np.broadcast_to(dst_parent_rest, world.shape).copy()
+    has_parent = dst_parents >= 0
+    ancestors = dst_parents[has_parent]
+    parent_world[:, has_parent] = (
+        world[:, ancestors]
+        @ np.linalg.inv(dst_rest[ancestors])[None]
+        @ dst_parent_rest[has_parent][None]
+    )
+    basis = (
+        np.linalg.inv(dst_rest)[None]
+        @ dst_parent_rest[None]
+        @ np.linalg.inv(parent_world)
+        @ world
+    )
+    if not child_locations:
+        basis[:, has_parent, :3, 3] = 0
+    return basis
+
+
+def matrices_to_pose(
+    matrices: np.ndarray,
+    rotation_modes: str | Sequence[str] = "QUATERNION",
+    previous: np.ndarray | None = None,
+):
+    """Inverse of `pose_to_matrices`: (frames, bones, 4, 4) -> (frames, bones, `POSE_CHANNELS`).
+    Rotations are continuous over frames, and with the (bones, `POSE_CHANNELS`) `previous` frame
+    also across consecutive chunks of a take."""
+    if isinstance(rotation_modes, str):
+        rotation_modes = [rotation_modes] * matrices.shape[1]
+    pose = np.zeros(matrices.shape[:2] + (POSE_CHANNELS,))
+    loc, rot, scale = decompose_matrices(matrices)
+    pose[..., :3], pose[..., 7:10] = loc, scale
+    for mode in set(rotation_modes):
+        idx = [b for b, m in enumerate(rotation_modes) if m == mode]
+        if mode in EULER_ORDERS:
+            rotation = matrices_to_eulers(rot[:, idx], mode)
+            if previous is not None:
+                rotation = np.unwrap(
+                    np.concatenate([previous[None, idx, 3:6], rotation]), axis=0
+                )[1:]
+            pose[:, idx, 3:6] = rotation
+            continue
+        quat = matrices_to_quaternions(rot[:, idx])
+        if previous is not None:
+            last = previous[idx, 3:7]
+            if mode == "AXIS_ANGLE":
+                half = last[:, :1] / 2
+                last = np.concatenate([np.cos(half), np.sin(half) * last[:, 1:]], -1)
+            quat = np.concatenate([last[None], quat])
+        quat = quaternions_compatible(quat)[0 if previous is None else 1 :]
+        if mode == "AXIS_ANGLE":
+            quat = quaternions_to_axis_angles(quat)
+        pose[:, idx, 3:7] = quat
+    return pose
+
+
+# name tokens that carry no meaning for matching: namespaces, rig prefixes and suffixes
+NAME_NOISE = re.compile(
+    r"^(mixamorig\d*|bip\d*|def|org|mch|cc|base|jnt|joint|bn|b|j|end|tip|bone|ctrl|fk)$"
+)
+SIDES = {"l": "L", "left": "L", "r": "R", "right": "R"}
+# canonical body part of a joined name or of a single token, covering Blender, Mixamo, Unreal,
+# 3ds Max Biped, CMU and SMPL naming
+BONE_ALIASES = {
+    "pelvis": "hips",
+    "hip": "hips",
+    "hips": "hips",
+    "abdomen": "spine",
+    "torso": "spine",
+    "spine": "spine",
+    "chest": "chest",
+    "upperchest": "chest",
+    "thorax": "chest",
+    "neck": "neck",
+    "head": "head",
+    "clavicle": "shoulder",
+    "collar": "shoulder",
+    "shoulder": "shoulder",
+    "arm": "upperarm",
+    "upperarm": "upperarm",
+    "humerus": "upperarm",
+    "forearm": "forearm",
+    "lowerarm": "forearm",
+    "elbow": "forearm",
+    "radius": "forearm",
+    "hand": "hand",
+    "wrist": "hand",
+    "thigh": "upleg",
+    "upleg": "upleg",
+    "upperleg": "upleg",
+    "femur": "upleg",
+    "leg": "leg",
+    "lowerleg": "leg",
+    "calf": "leg",
+    "shin": "leg",
+    "knee": "leg",
+    "tibia": "leg",
+    "foot": "foot",
+    "ankle": "foot",
+    "toe": "toe",
+    "toes": "toe",
+    "toebase": "toe",
+    "ball": "toe",
+    "thumb": "thumb",
+    "index": "index",
+    "pointer": "index",
+    "middle": "middle",
+    "ring": "ring",
+    "pinky": "pinky",
+    "pinkie": "pinky",
+    "little": "pinky",
+}
+FINGERS = {"thumb", "index", "middle", "ring", "pinky"}
+
+
+def name_tokens(name: str):
+    """Lowercase word and number tokens of a bone name, camelCase, namespaces and `NAME_NOISE`
+    split off"""
+    name = name.rsplit(":", 1)[-1]
+    name = re.sub(r"([a-z])([A-Z])", r"\1 \2", name)
+    name = re.sub(r"([A-Z]+)([A-Z][a-z])", r"\1 \2", name)
+    tokens = []
+    for word in re.findall(r"[A-Za-z]+\d*|\d+", name.lower()):
+        # noise like "bip01" goes with its number
+        if not NAME_NOISE.match(word):
+            tokens += re.findall(r"[a-z]+|\d+", word)
+    return tokens
+
+
+def parse_bone_name(name: str):
+    """(part, side, number, tokens) of a bone name: the canonical body part (`BONE_ALIASES`) or the
+    joined remaining tokens, "L", "R" or "", the last number or None, and the meaningful tokens
+    """
+    side, number, words = "", None, []
+    for token in name_tokens(name):
+        if token.isdigit():
+            number = int(token)
+        elif token in SIDES:
+            side = SIDES[token]
+        elif token[0] in "lr" and token[1:] in BONE_ALIASES and len(token) > 2:
+            # CMU style "lhumerus"
+            side = SIDES[token[0]]
+            words.append(token[1:])
+        else:
+            words.append(token)
+    fingers = [w for w in words if BONE_ALIASES.get(w) in FINGERS]
+    joined = "".join(words)
+    if fingers:
+        part = BONE_ALIASES[fingers[0]]
+    elif joined in BONE_ALIASES:
+        part = BONE_ALIASES[joined]
+    else:
+        part = "".join(BONE_ALIASES.get(w, w) for w in words)
+    if part == "hips" and side:
+        # SMPL's "left_hip" is the thigh
+        part = "upleg"
+    tokens = {BONE_ALIASES.get(w, w) for w in words}
+    return part, side, number, tokens
+
+
+def bone_depths(parents: np.ndarray):
+    depths = np.zeros(len(parents), dtype=int)
+    for level, bones in enumerate(hierarchy_levels(np.asarray(parents))):
+        depths[bones] = level
+    return depths
+
+
+def match_bones(
+    src_names: Sequence[str],
+    src_parents: np.ndarray,
+    dst_names: Sequence[str],
+    dst_parents: np.ndarray,
+):
+    """Pair source with destination bones of another rig by name and hierarchy, {src: dst}.
+    Names are parsed into (body part, side, number) keys through the alias table and looked up
+    in an index, so the cost grows with the number of bones, not with their product:
+
+    1. bones with the same part and side are paired in order of number then depth when both rigs
+       have as many of them (`Spine, Spine1, Spine2` to `spine_01, spine_02, spine_03`), else by
+       equal numbers
+    2. the rest by their rarest shared tokens from an inverted index, same side only, preferring
+       children of the match of their parent
+    3. the rest when they are the only unmatched child on both sides of matched parents
+    Every destination bone is used once."""
+    if not len(src_names) or not len(dst_names):
+        return {}
+    src = [parse_bone_name(n) for n in src_names]
+    dst = [parse_bone_name(n) for n in dst_names]
+    src_depth, dst_depth = bone_depths(src_parents), bone_depths(dst_parents)
+    matched: dict[int, int] = {}
+    taken: set[int] = set()
+
+    def pair(s: int, d: int):
+        matched[s] = d
+        taken.add(d)
+
+    groups: dict[tuple[str, str], list[int]] = {}
+    for d, (part, side, _, _) in enumerate(dst):
+        groups.setdefault((part, side), []).append(d)
+    src_groups: dict[tuple[str, str], list[int]] = {}
+    for s, (part, side, _, _) in enumerate(src):
+        src_groups.setdefault((part, side), []).append(s)
+    for key, members in src_groups.items():
+        candidates = groups.get(key, [])
+        if not candidates or not key[0]:
+            continue
+        if len(members) == len(candidates):
+            members = sorted(members, key=lambda i: (src[i][2] or 0, src_depth[i]))
+            candidates = sorted(
+                candidates, key=lambda i: (dst[i][2] or 0, dst_depth[i])
+            )
+            for s, d in zip(members, candidates):
+                pair(s, d)
+            continue
+        by_number = {dst[d][2]: d for d in candidates}
+        for s in members:
+            d = by_number.get(src[s][2])
+            if d is not None and d not in taken:
+                pair(s, d)
+
+    inverted: dict[str, list[int]] = {}
+    for d, (_, _, _, tokens) in enumerate(dst):
+        for token in tokens:
+            inverted.setdefault(token, []).append(d)
+    for s in bone_order(src_parents):
+        if s in matched:
+            continue
+        _, side, number, tokens = src[s]
+        parent = src_parents[s]
+        parent_match = matched.get(parent, -2) if parent >= 0 else -1
+        scores: dict[int, float] = {}
+        for token in tokens:
+            candidates = inverted.get(token, ())
+            if len(candidates) > 64:
+                # too common to tell bones apart, and scoring it would be quadratic
+                continue
+            for d in candidates:
+                if d not in taken and dst[d][1] == side:
+                    scores[d] = scores.get(d, 0.0) + math.log(
+                        len(dst) / len(candidates)
+                    )
+        if not scores:
+            continue
+        best = max(
+            scores,
+            key=lambda d: (
+                scores[d],
+                dst_parents[d] == parent_match,
+                dst[d][2] == number,
+                -abs(dst_depth[d] - src_depth[s]),
+            ),
+        )
+        pair(s, best)
+
+    dst_children: dict[int, list[int]] = {}
+    for d, parent in enumerate(dst_parents):
+        dst_children.setdefault(int(parent), []).append(d)
+    src_children: dict[int, list[int]] = {}
+    for s, parent in enumerate(src_parents):
+        src_children.setdefault(int(parent), []).append(s)
+    for s in bone_order(src_parents):
+        parent = int(src_parents[s])
+        if s in matched or parent not in matched:
+            continue
+        free_src = [c for c in src_children[parent] if c not in matched]
+        free_dst = [
+            c
+            for c in dst_children.get(matched[parent], [])
+            if c not in taken and dst[c][1] == src[s][1]
+        ]
+        if len(free_src) == 1 and len(free_dst) == 1:
+            pair(s, free_dst[0])
+    return {src_names[s]: dst_names[d] for s, d in sorted(matched.items())}
+
+
+def bone_order(parents: np.ndarray):
+    """Bone indices with parents before children"""
+    return [int(b) for level in hierarchy_levels(np.asarray(parents)) for b in level]
+
+
+def synthetic_hierarchy(bones: int, depth=8, branching=2, seed=0):
+    """Random rig for benchmarks: (rest (bones, 4, 4), parents (bones,), lengths (bones,)) of a
+    hierarchy at most `depth` bones deep where a bone has at most `branching` children, parents
+    before children. Chains are grown depth first, a new root starts once every bone is full.
+    Children start at their parent's tail, along its Y axis like Blender bones."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.uniform(0.1, 0.3, bones)
+    parents = np.full(bones, -1)
+    levels, children = np.zeros(bones, dtype=int), np.zeros(bones, dtype=int)
+    open_bones: list[int] = []
+    for i in range(bones):
+        if open_bones:
+            parent = open_bones[-1]
+            parents[i], levels[i] = parent, levels[parent] + 1
+            children[parent] += 1
+            if children[parent] >= branching:
+                open_bones.remove(parent)
+        if levels[i] < depth - 1 and branching > 0:
+            open_bones.append(i)
+    axis_angle = np.empty((bones, 4))
+    axis_angle[:, 0] = rng.uniform(0, 0.6, bones)
+    axis_angle[:, 1:] = rng.normal(size=(bones, 3))
+    local = np.zeros((bones, 4, 4))
+    local[:, :3, :3] = axis_angles_to_matrices(axis_angle)
+    local[:, 3, 3] = 1
+    roots = parents < 0
+    local[roots, :3, 3] = rng.uniform(-1, 1, (roots.sum(), 3))
+    local[~roots, 1, 3] = lengths[parents[~roots]]
+    rest = local.copy()
+    for i in np.flatnonzero(~roots):
+        rest[i] = rest[parents[i]] @ local[i]
+    return rest, parents, lengths
+
+
+def synthetic_take(parents: np.ndarray, frames: int, seed=0, amplitude=0.5):
+    """Random smooth FK motion for benchmarks: (frames, bones, `POSE_CHANNELS`) quaternion pose of a
+    few overlapping sines per rotation axis of up to `amplitude` radians each, roots also move
+    """
+    rng = np.random.default_rng(seed)
+    bones = len(parents)
+    t = np.arange(frames)[:, None, None, None]
+    shape = (3, bones, 3)
+    freq = rng.uniform(0.005, 0.05, shape)
+    phase = rng.uniform(0, 2 * np.pi, shape)
+    amp = amplitude * rng.uniform(0.2, 1.0, shape)
+    waves = amp * np.sin(2 * np.pi * freq * t + phase)
+    rotvec = waves.sum(axis=1)
+    axis_angle = np.concatenate(
+        [np.linalg.norm(rotvec, axis=-1, keepdims=True), rotvec], axis=-1
+    )
+    quat = np.concatenate(
+        [
+            np.cos(axis_angle[..., :1] / 2),
+            np.sin(axis_angle[..., :1] / 2)
+            * rotvec
+            / np.maximum(axis_angle[..., :1], 1e-12),
+        ],
+        axis=-1,
+    )
+    pose = np.zeros((frames, bones, POSE_CHANNELS))
+    pose[..., 3:7] = quaternions_compatible(quat)
+    pose[..., 7:10] = 1.0
+    roots = np.asarray(parents) < 0
+    pose[:, roots, :3] = waves[:, :, roots].sum(axis=1)
+    return pose
+
+
+TRANSFORMS_MAGIC = b"FKIK"
+TRANSFORMS_VERSION = 1
+POSE_CHANNEL_NAMES = [
+    *("location_x", "location_y", "location_z"),
+    *("rotation_0", "rotation_1", "rotation_2", "rotation_3"),
+    *("scale_x", "scale_y", "scale_z"),
+]
+
+
+def create_transforms(
+    path: str,
+    frames: int,
+    bones: Sequence[str],
+    rotation_modes: str | Sequence[str] = "QUATERNION",
+    frame_start=0,
+    fps=0.0,
+    frame_step=1.0,
+):
+    """Create a transforms container and return its writable (frames, bones, `POSE_CHANNELS`)
+    float32 memory map, filled incrementally by the caller.
+
+    Layout: `TRANSFORMS_MAGIC`, the byte length of the JSON header as little-endian uint32,
+    the UTF-8 JSON header padded with spaces so the data starts on a 64 byte boundary, then the
+    C-ordered little-endian float32 array. `read_transforms` pages it lazily."""
+    if isinstance(rotation_modes, str):
+        rotation_modes = [rotation_modes] * len(bones)
+    shape = (frames, len(bones), POSE_CHANNELS)
+    header = json.dumps(
+        dict(
+            version=TRANSFORMS_VERSION,
+            dtype="<f4",
+            shape=shape,
+            channels=POSE_CHANNEL_NAMES,
+            bones=list(bones),
+            rotation_modes=list(rotation_modes),
+            frame_start=frame_start,
+            frame_end=frame_start + (frames - 1) * frame_step,
+            frame_step=frame_step,
+            fps=fps,
+        )
+    ).encode()
+    header += b" " * (-(len(TRANSFORMS_MAGIC) + 4 + len(header)) % 64)
+    offset = len(TRANSFORMS_MAGIC) + 4 + len(header)
+    with open(path, "wb") as f:
+        f.write(TRANSFORMS_MAGIC + len(header).to_bytes(4, "little") + header)
+        f.truncate(offset + int(np.prod(shape)) * 4)
+    return np.memmap(path, dtype="<f4", mode="r+", offset=offset, shape=shape)
+
+
+def write_transforms(
+    path: str,
+    pose: np.ndarray,
+    bones: Sequence[str],
+    rotation_modes: str | Sequence[str] = "QUATERNION",
+    frame_start=0,
+    fps=0.0,
+    frame_step=1.0,
+):
+    """Write a whole (frames, bones, `POSE_CHANNELS`) array as a transforms container"""
+    out = create_transforms(
+        path, len(pose), bones, rotation_modes, frame_start, fps, frame_step
+    )
+    out[:] = pose
+    out.flush()
+
+
+def read_transforms(path: str, mode="r"):
+    """(header, memory-mapped (frames, bones, `POSE_CHANNELS`) float32 array) of a transforms container,
+    frames are only read from disk when accessed"""
+    with open(path, "rb") as f:
+        if f.read(len(TRANSFORMS_MAGIC)) != TRANSFORMS_MAGIC:
+            raise ValueError(f"Not a transforms file: {path}")
+        size = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(size))
+    if header["version"] > TRANSFORMS_VERSION:
+        raise ValueError(f"Unsupported transforms version {header['version']}: {path}")
+    offset = len(TRANSFORMS_MAGIC) + 4 + size
+    pose = np.memmap(
+        path,
+        dtype=header["dtype"],
+        mode=mode,
+        offset=offset,
+        shape=tuple(header["shape"]),
+    )
+    return header, pose
+
+
+# upper bounds of the latency histogram buckets, 0.1 ms doubling up to ~1.6 s
+LATENCY_BUCKETS = 1e-4 * 2.0 ** np.arange(15)
+
+
+def latency_histogram(seconds: Sequence[float]):
+    """Summary and bucket counts of latency samples, the last bucket counts the overflow"""
+    values = np.asarray(seconds, dtype=np.float64)
+    if not len(values):
+        return dict(count=0)
+    counts = np.bincount(
+        np.searchsorted(LATENCY_BUCKETS, values), minlength=len(LATENCY_BUCKETS) + 1
+    )
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]) * 1e3
+    return dict(
+        count=len(values),
+        mean_ms=values.mean() * 1e3,
+        p50_ms=p50,
+        p90_ms=p90,
+        p99_ms=p99,
+        max_ms=values.max() * 1e3,
+        le_ms=(LATENCY_BUCKETS * 1e3).tolist(),
+        counts=counts.tolist(),
+    )
+
+
+class Profile:
+    """Timing spans, latency samples and counters of one run, see `report`.
+    While entered it is `Profile.current`, which instrumented code records into through
+    `profile_span`, `profile_count` and `profile_sample`, those do nothing without one.
+    Time between `pause` and `resume`, e.g. UI redraws between two steps of a generator,
+    is left out of the open spans."""
+
+    current: "Profile | None" = None
+    last: "Profile | None" = None
+
+    def __init__(self, **meta):
+        self.meta = meta
+        self.spans: list[dict] = []
+        self.open: list[dict] = []
+        self.counters: dict[str, int] = {}
+        self.samples: dict[str, list[float]] = {}
+        self.time_start = time.perf_counter()
+        self.seconds = 0.0
+        self.idle = 0.0
+        self._paused = None
+        self._previous = None
+
+    def __enter__(self):
+        self._previous, Profile.current = Profile.current, self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.resume()
+        self.seconds = time.perf_counter() - self.time_start - self.idle
+        Profile.current, self._previous = self._previous, None
+        Profile.last = self
+        return False
+
+    @contextmanager
+    def span(self, name: str):
+        record = dict(
+            name=name,
+            depth=len(self.open),
+            start=time.perf_counter() - self.time_start,
+            seconds=0.0,
+            idle=0.0,
+        )
+        self.spans.append(record)
+        self.open.append(record)
+        try:
+            yield record
+        finally:
+            self.open.remove(record)
+            elapsed = time.perf_counter() - self.time_start - record["start"]
+            record["seconds"] = elapsed - record.pop("idle")
+
+    def pause(self):
+        self._paused = time.perf_counter()
+
+    def resume(self):
+        if self._paused is None:
+            return
+        idle = time.perf_counter() - self._paused
+        for record in self.open:
+            record["idle"] += idle
+        self.idle += idle
+        self._paused = None
+
+    def count(self, name: str, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def sample(self, name: str, seconds: float):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def stages(self):
+        """{span name: (calls, total seconds)} in order of first use, nested spans included"""
+        stages: dict[str, tuple[int, float]] = {}
+        for record in self.spans:
+            calls, seconds = stages.get(record["name"], (0, 0.0))
+            stages[record["name"]] = (calls + 1, seconds + record["seconds"])
+        return stages
+
+    def report(self, spans=True):
+        """JSON serializable summary of the run, `spans` adds every single span"""
+        report = dict(
+            meta=self.meta,
+            seconds=self.seconds,
+            idle_seconds=self.idle,
+            stages={
+                name: dict(calls=calls, seconds=seconds)
+                for name, (calls, seconds) in self.stages().items()
+            },
+            counters=self.counters,
+            latency={name: latency_histogram(v) for name, v in self.samples.items()},
+        )
+        if spans:
+            report["spans"] = self.spans
+        return report
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, default=float)
+
+
+@contextmanager
+def profile_span(name: str):
+    """`Profile.span` of the current profile, if any"""
+    if Profile.current is None:
+        yield None
+    else:
+        with Profile.current.span(name) as record:
+            yield record
+
+
+def profile_count(name: str, n=1):
+    if Profile.current is not None:
+        Profile.current.count(name, n)
+
+
+def profile_sample(name: str, seconds: float):
+    if Profile.current is not None:
+        Profile.current.sample(name, seconds)
+
+
+class BVH:
+    """Streaming BVH reader: the hierarchy is parsed once when opened, motion frames are read
+    on demand in chunks, so a take of any length is never fully in memory.
+
+    Joints keep the BVH axes and units, rest matrices are translated by the accumulated offsets
+    without rotation. End sites are skipped."""
+
+    def __init__(self, path: str):
+        self.names: list[str] = []
+        self.parents: list[int] = []
+        self.offsets: list[list[float]] = []
+        self.channels: list[list[str]] = []
+        self.file = open(path)
+        stack: list[int | None] = []  # None for end sites
+        pending: int | None = None
+        for line in self.file:
+            tokens = line.split()
+            key = tokens[0].upper() if tokens else ""
+            if key in ("ROOT", "JOINT"):
+                pending = len(self.names)
+                self.names.append(" ".join(tokens[1:]))
+                self.parents.append(
+                    stack[-1] if stack and stack[-1] is not None else -1
+                )
+                self.offsets.append([0.0, 0.0, 0.0])
+                self.channels.append([])
+            elif key == "END":
+                pending = None
+            elif key == "{":
+                stack.append(pending)
+            elif key == "}":
+                stack.pop()
+            elif key == "OFFSET" and stack[-1] is not None:
+                self.offsets[stack[-1]] = [float(v) for v in tokens[1:4]]
+            elif key == "CHANNELS":
+                self.channels[stack[-1]] = tokens[2:]  # type: ignore
+            elif key == "MOTION":
+                break
+        self.frames = int(self.file.readline().split(":")[1])
+        self.frame_time = float(self.file.readline().split(":")[1])
+        self.frames_read = 0
+
+        # column of every motion channel, -1 when the joint doesn't have it
+        self.columns = np.full((len(self.names), 6), -1)
+        column = 0
+        for j, channels in enumerate(self.channels):
+            for name in channels:
+                axis = "XYZ".index(name[0].upper())
+                self.columns[j, axis + (3 if "rotation" in name.lower() else 0)] = (
+                    column
+                )
+                column += 1
+        self.width = column
+        # position channels replace the joint's offset, only the difference goes in the basis
+        self.position_offsets = np.where(
+            self.columns[:, :3] >= 0, np.array(self.offsets).reshape(-1, 3), 0.0
+        )
+        self.orders = [
+            "".join(c[0].upper() for c in reversed(channels) if "rotation" in c.lower())
+            or "XYZ"
+            for channels in self.channels
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    @property
+    def fps(self):
+        return 1 / self.frame_time if self.frame_time else 0.0
+
+    def rest(self):
+        """(joints, 4, 4) rest matrices, the accumulated joint offsets"""
+        heads = np.zeros((len(self.names), 3))
+        for j, (parent, offset) in enumerate(zip(self.parents, self.offsets)):
+            heads[j] = offset
+            if parent >= 0:
+                heads[j] += heads[parent]
+        rest = np.tile(np.eye(4), (len(self.names), 1, 1))
+        rest[:, :3, 3] = heads
+        return rest
+
+    def read(self, count: int):
+        """The next `count` motion frames (fewer at the end) as a (frames, channels) array"""
+        count = min(count, self.frames - self.frames_read)
+        lines = [self.file.readline() for _ in range(count)]
+        motion = np.fromstring(" ".join(lines), sep=" ")  # type: ignore
+        if motion.size != count * self.width:
+            raise ValueError(
+                f"truncated motion after frame {self.frames_read}: "
+                f"expected {count} frames of {self.width} channels"
+            )
+        self.frames_read += count
+        return motion.reshape(count, self.width)
+
+    def chunks(self, size=1024):
+        """Iterate the remaining motion in (size, channels) chunks"""
+        while self.frames_read < self.frames:
+            yield self.read(size)
+
+    def basis(self, motion: np.ndarray):
+        """(frames, channels) motion -> (frames, joints, 4, 4) basis matrices relative to `rest`:
+        the joint's position channels, which are absolute and replace its offset, then its
+        rotations in channel order, in degrees
+        """
+        padded = np.concatenate([motion, np.zeros((len(motion), 1))], axis=1)
+        values = padded[:, self.columns]  # missing channels read the zero column
+        basis = np.zeros(values.shape[:2] + (4, 4))
+        basis[..., :3, 3] = values[..., :3] - self.position_offsets
+        basis[..., 3, 3] = 1
+        for order in set(self.orders):
+            idx = [j for j, o in enumerate(self.orders) if o == order]
+            basis[:, idx, :3, :3] = eulers_to_matrices(
+                np.radians(values[:, idx, 3:]), order
+            )
+        return basis
+
+
+def convert_bvh(
+    path: str,
+    output: str,
+    bones: Sequence[str] | None = None,
+    rotation_mode="QUATERNION",
+    no_scale=False,
+    chunk=1024,
+):
+    """Stream a BVH take through `fk_to_ik` chunk by chunk into a transforms container, written
+    incrementally through a memory map so peak memory stays flat with the take's length.
+    `bones` default to every joint. Returns the converted bone names."""
+    with BVH(path) as bvh:
+        names = list(bones) if bones else bvh.names
+        missing = [name for name in names if name not in bvh.names]
+        if missing:
+            raise ValueError(f"Joints not found: {missing}")
+        selected = [bvh.names.index(name) for name in names]
+        rest, parents = bvh.rest(), np.array(bvh.parents)
+        out = create_transforms(
+            output, bvh.frames, names, rotation_mode, frame_start=1, fps=bvh.fps
+        )
+        previous = None
+        for motion in bvh.chunks(chunk):
+            with profile_span("fk to ik"):
+                local = fk_to_ik(
+                    rest, parents, bvh.basis(motion), selected, no_scale=no_scale
+                )
+                pose = matrices_to_pose(local, rotation_mode, previous)
+            with profile_span("write"):
+                out[bvh.frames_read - len(motion) : bvh.frames_read] = pose
+            previous = pose[-1]
+            profile_count("frames", len(motion))
+        out.flush()
+        del out
+        return names
+
+
+def main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="python fktoikcore.py", description="FK to IK conversion without Blender"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    bvh = sub.add_parser("bvh", help="stream a BVH take to unparented joint channels")
+    bvh.add_argument("input")
+    bvh.add_argument("output", help="transforms container, see `read_transforms`")
+    bvh.add_argument("-b", "--bones", nargs="+", help="default: all joints")
+    bvh.add_argument(
+        "-r",
+        "--rotation-mode",
+        default="QUATERNION",
+        choices=["QUATERNION", "AXIS_ANGLE", *EULER_ORDERS],
+    )
+    bvh.add_argument("--no-scale", action="store_true")
+    bvh.add_argument("--chunk", type=int, default=1024, help="frames per chunk")
+    args = parser.parse_args(argv)
+
+    convert_bvh(
+        args.input,
+        args.output,
+        args.bones,
+        rotation_mode=args.rotation_mode,
+        no_scale=args.no_scale,
+        chunk=args.chunk,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
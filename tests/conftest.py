@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the add-on is a flat pair of modules, import them from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
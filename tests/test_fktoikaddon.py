@@ -0,0 +1,37 @@
+"""Checks of the add-on module that don't need Blender: it's only parsed, never imported."""
+
+import builtins
+import os
+import symtable
+
+ADDON = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fktoikaddon.py")
+
+
+def undefined_globals(source: str, filename: str):
+    """{(scope, name)} of global names read by functions and classes that the module never binds"""
+    top = symtable.symtable(source, filename, "exec")
+    bound = {
+        s.get_name()
+        for s in top.get_symbols()
+        if s.is_assigned() or s.is_imported() or s.is_namespace()
+    }
+    bound |= set(dir(builtins)) | {"__file__"}
+    missing = set()
+    stack = list(top.get_children())
+    while stack:
+        table = stack.pop()
+        stack.extend(table.get_children())
+        for s in table.get_symbols():
+            if s.is_global() and s.is_referenced() and s.get_name() not in bound:
+                missing.add((table.get_name(), s.get_name()))
+    return missing
+
+
+# the panel's debug row, predates the core split
+KNOWN = {("draw", "get_scale")}
+
+
+def test_no_undefined_globals():
+    # e.g. a core helper used by the incremental append without being imported
+    with open(ADDON, encoding="utf-8") as f:
+        assert undefined_globals(f.read(), ADDON) - KNOWN == set()
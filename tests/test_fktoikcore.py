@@ -0,0 +1,247 @@
+import numpy as np
+import pytest
+
+from fktoikcore import (
+    BVH,
+    block_hashes,
+    changed_ranges,
+    create_transforms,
+    decimate_samples,
+    distance_error,
+    evaluate_shared_keys,
+    fk_to_ik,
+    forward_kinematics,
+    match_bones,
+    matrices_to_pose,
+    merge_ranges,
+    pose_to_matrices,
+    read_transforms,
+    retarget,
+    retarget_offsets,
+    sample_frames,
+)
+
+
+def random_pose(rng, frames, bones, scale=True):
+    """(frames, bones, 10) quaternion pose with random rotations, small offsets and scales"""
+    pose = np.zeros((frames, bones, 10))
+    quat = rng.normal(size=(frames, bones, 4))
+    pose[..., 3:7] = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    pose[..., :3] = rng.normal(scale=0.3, size=(frames, bones, 3))
+    pose[..., 7:10] = rng.uniform(0.8, 1.2, (frames, bones, 3)) if scale else 1.0
+    return pose
+
+
+def test_fk_to_ik_matches_naive_reference():
+    rng = np.random.default_rng(1)
+    bones = 24
+    parents = np.array([-1] + [rng.integers(0, i) for i in range(1, bones)])
+    rest = pose_to_matrices(random_pose(rng, 1, bones, scale=False))[0]
+    pose = random_pose(rng, 6, bones)
+    selected = [3, 7, 23, 0]
+    local = fk_to_ik(rest, parents, pose, selected)
+
+    basis = pose_to_matrices(pose)
+    for f in range(len(pose)):
+        world = {}
+
+        def world_of(i):
+            if i not in world:
+                parent = parents[i]
+                world[i] = rest[i] @ basis[f, i]
+                if parent >= 0:
+                    world[i] = world_of(parent) @ np.linalg.inv(rest[parent]) @ world[i]
+            return world[i]
+
+        for b, i in enumerate(selected):
+            expected = np.linalg.inv(rest[i]) @ world_of(i)
+            np.testing.assert_allclose(local[f, b], expected, atol=1e-9)
+
+
+@pytest.mark.parametrize("mode", ["QUATERNION", "XYZ", "AXIS_ANGLE"])
+def test_matrices_to_pose_chunks_continue(mode):
+    # two full turns about a tilted axis, wrapping Euler angles and quaternion signs
+    angle = np.linspace(0, 4 * np.pi, 50)
+    axis = np.array([1.0, 2.0, 3.0]) / np.linalg.norm([1.0, 2.0, 3.0])
+    quat = np.zeros((50, 1, 10))
+    quat[..., 3] = np.cos(angle / 2)[:, None]
+    quat[..., 4:7] = (np.sin(angle / 2)[:, None] * axis)[:, None]
+    quat[..., 7:10] = 1
+    matrices = pose_to_matrices(quat)
+
+    whole = matrices_to_pose(matrices, mode)
+    first = matrices_to_pose(matrices[:20], mode)
+    second = matrices_to_pose(matrices[20:], mode, previous=first[-1])
+    np.testing.assert_allclose(np.concatenate([first, second]), whole, atol=1e-9)
+    np.testing.assert_allclose(pose_to_matrices(whole, mode), matrices, atol=1e-9)
+    if mode != "AXIS_ANGLE":
+        # no jumps between frames, across the chunk boundary too
+        assert np.abs(np.diff(whole[:, 0, 3:7], axis=0)).max() < 0.5
+
+
+def test_decimate_samples_within_tolerance():
+    frames = np.arange(1.0, 121.0)
+    values = np.column_stack(
+        [np.sin(frames / 9), np.cos(frames / 13) * 2, np.where(frames > 60, 1.0, 0.0)]
+    )
+    tolerance = 1e-3
+    keys, handle_left, handle_right = decimate_samples(
+        frames, values, distance_error, tolerance
+    )
+    assert keys[0] == 0 and keys[-1] == len(frames) - 1
+    assert len(keys) < len(frames)
+    approx = evaluate_shared_keys(
+        frames[keys], values[keys], handle_left, handle_right, frames
+    )
+    assert distance_error(approx, values).max() <= tolerance
+
+
+def test_transforms_round_trip(tmp_path):
+    path = str(tmp_path / "take.fkik")
+    pose = np.random.default_rng(0).normal(size=(7, 3, 10)).astype(np.float32)
+    modes = ["QUATERNION", "XYZ", "AXIS_ANGLE"]
+    out = create_transforms(path, 7, ["a", "b", "c"], modes, frame_start=5, fps=24)
+    out[:4] = pose[:4]
+    out[4:] = pose[4:]
+    out.flush()
+    del out
+    header, read = read_transforms(path)
+    np.testing.assert_array_equal(read, pose)
+    assert header["bones"] == ["a", "b", "c"]
+    assert header["rotation_modes"] == modes
+    assert (header["frame_start"], header["frame_end"], header["fps"]) == (5, 11, 24)
+    del read
+
+
+def test_transforms_rejects_other_files(tmp_path):
+    path = tmp_path / "take.bin"
+    path.write_bytes(b"nope" * 8)
+    with pytest.raises(ValueError):
+        read_transforms(str(path))
+
+
+def test_incremental_rebake_ranges():
+    """The hashing side of an incremental Append rerun: edit one block, rebake only it"""
+    values = np.random.default_rng(0).normal(size=(40, 10))
+    old = block_hashes(values, 16)
+    edited = values.copy()
+    edited[20] += 1
+    new = block_hashes(edited, 16)
+    assert changed_ranges(old, new, 1, 40, 16) == [(17, 32)]
+    assert changed_ranges(new, new, 1, 40, 16) == []
+    # a bone never hashed before is dirty over the whole range
+    assert changed_ranges([], new, 1, 40, 16) == [(1, 40)]
+    dirty = {"a": [(17, 32)], "b": [(1, 16)], "c": [(35, 40)]}
+    assert merge_ranges([r for rs in dirty.values() for r in rs]) == [(1, 32), (35, 40)]
+
+
+def test_merge_ranges():
+    assert merge_ranges([]) == []
+    assert merge_ranges([(10, 12), (1, 3), (4, 5), (11, 20)]) == [(1, 5), (10, 20)]
+    assert merge_ranges([(1, 3), (5, 6)]) == [(1, 3), (5, 6)]
+
+
+def test_changed_ranges_last_block_clamped():
+    old = ["a", "b", "c"]
+    assert changed_ranges(old, ["a", "x", "y"], 1, 40, 16) == [(17, 40)]
+    assert changed_ranges(old, ["x", "b", "y"], 1, 40, 16) == [(1, 16), (33, 40)]
+
+
+@pytest.mark.parametrize(
+    "start, end, step, expected",
+    [
+        (1, 5, 1.0, [1, 2, 3, 4, 5]),
+        (1, 5, 2.0, [1, 3, 5]),
+        (1, 6, 2.0, [1, 3, 5]),
+        (1, 2, 0.25, [1, 1.25, 1.5, 1.75, 2]),
+        # float steps that don't divide exactly still reach the end
+        (0, 1, 0.1, np.arange(11) / 10),
+        (3, 3, 1.0, [3]),
+        (5, 1, 1.0, []),
+    ],
+)
+def test_sample_frames(start, end, step, expected):
+    np.testing.assert_allclose(sample_frames(start, end, step), expected)
+
+
+def test_match_bones_aliases():
+    src = [
+        "mixamorig:Hips",
+        "mixamorig:Spine",
+        "mixamorig:LeftUpLeg",
+        "mixamorig:RightUpLeg",
+    ]
+    dst = ["pelvis", "spine_01", "thigh_l", "thigh_r"]
+    parents = np.array([-1, 0, 0, 0])
+    assert match_bones(src, parents, dst, parents) == dict(zip(src, dst))
+
+
+def translation(x, y, z):
+    m = np.eye(4)
+    m[:3, 3] = x, y, z
+    return m
+
+
+def rotation_z(angle):
+    m = np.eye(4)
+    c, s = np.cos(angle), np.sin(angle)
+    m[:2, :2] = [[c, -s], [s, c]]
+    return m
+
+
+def test_retarget_unmapped_intermediate_parent():
+    # A -> B -> C, only A and C paired: B still moves with A in Blender
+    rest = np.array([translation(0, 0, 0), translation(0, 1, 0), translation(0, 2, 0)])
+    parents = np.array([-1, 0, 1])
+    turn = rotation_z(np.pi / 2)
+    src_world = (turn @ rest)[None]
+    pairs = [0, 2]
+    offsets = retarget_offsets(rest[pairs], rest[pairs])
+    basis = retarget(
+        src_world[:, pairs],
+        offsets,
+        rest[pairs],
+        dst_parents=np.array([-1, 0]),
+        dst_parent_rest=np.array([np.eye(4), rest[1]]),
+    )
+    full = np.broadcast_to(np.eye(4), (1, 3, 4, 4)).copy()
+    full[:, pairs] = basis
+    world = forward_kinematics(rest, parents, full)
+    np.testing.assert_allclose(world, src_world, atol=1e-9)
+
+
+BVH_TAKE = """HIERARCHY
+ROOT Hips
+{
+  OFFSET 1 2 3
+  CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+  JOINT Chest
+  {
+    OFFSET 0 4 0
+    CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+    End Site
+    {
+      OFFSET 0 1 0
+    }
+  }
+}
+MOTION
+Frames: 2
+Frame Time: 0.033333
+1 2 3 0 0 0 0 4 0 0 0 0
+5 2 3 90 0 0 0 4 0 0 0 0
+"""
+
+
+def test_bvh_positions_replace_offsets(tmp_path):
+    path = tmp_path / "take.bvh"
+    path.write_text(BVH_TAKE)
+    with BVH(str(path)) as bvh:
+        rest = bvh.rest()
+        world = forward_kinematics(
+            rest, np.array(bvh.parents), bvh.basis(bvh.read(bvh.frames))
+        )
+    np.testing.assert_allclose(world[0], rest, atol=1e-9)
+    np.testing.assert_allclose(world[1, 0, :3, 3], [5, 2, 3], atol=1e-9)
+    # the chest's 4 units up are turned along -x by the root's 90° about z
+    np.testing.assert_allclose(world[1, 1, :3, 3], [1, 2, 3], atol=1e-9)